@@ -1,7 +1,16 @@
 from __future__ import annotations
 
 import plotly.graph_objects as go
-from shared import df, plot_timeseries, value_box_server, value_box_ui
+from shared import (
+    HISTORY_WINDOWS,
+    df,
+    history_dfs,
+    latest_scores,
+    plot_timeseries,
+    update_timeseries,
+    value_box_server,
+    value_box_ui,
+)
 from shiny import App, Inputs, Outputs, Session, reactive, ui
 from shinywidgets import output_widget, render_plotly
 
@@ -9,7 +18,12 @@ all_models = ["model_1", "model_2", "model_3", "model_4"]
 
 app_ui = ui.page_sidebar(
     ui.sidebar(
-        ui.input_checkbox_group("models", "Models", all_models, selected=all_models)
+        ui.input_checkbox_group("models", "Models", all_models, selected=all_models),
+        ui.input_select(
+            "window",
+            "Time window",
+            {"live": "Live", **{str(v): k for k, v in HISTORY_WINDOWS.items()}},
+        ),
     ),
     ui.layout_columns(
         value_box_ui("model_1", "Model 1"),
@@ -34,33 +48,65 @@ app_ui = ui.page_sidebar(
 
 
 def server(input: Inputs, output: Outputs, session: Session):
-    # Note that df from shared.py is a reactive calc that gets
-    # invalidated (approximately) when the database updates
+    # Note that df (and latest_scores) from shared.py are reactive values that get
+    # updated when the database updates
     # We can choose to ignore the invalidation by doing an isolated read
-    @reactive.calc
-    def maybe_paused_df():
+    def maybe_paused(source):
         if not input.pause():
-            return df()
+            return source()
         with reactive.isolate():
-            return df()
+            return source()
+
+    @reactive.calc
+    def maybe_paused_latest():
+        return maybe_paused(latest_scores)
 
     # Source the value box module server code for each model
     for model in all_models:
-        value_box_server(model, maybe_paused_df, model)
+        value_box_server(model, maybe_paused_latest, model)
+
+    # Longer time windows come from (shared) queries against the rollup tables
+    # (these queries run in a worker thread, so they're async)
+    @reactive.calc
+    async def plot_df():
+        if input.window() == "live":
+            return maybe_paused(df)
+        history_df = history_dfs[int(input.window())]
+        if not input.pause():
+            return await history_df()
+        with reactive.isolate():
+            return await history_df()
 
     # Create an empty plotly figure on page load
     @render_plotly
     def plot():
         return go.FigureWidget()
 
+    # The time window currently shown in the plot
+    plotted_window = None
+
     # Update the plotly figure with the latest data
     @reactive.effect
-    def _():
-        d = maybe_paused_df()
+    async def _():
+        nonlocal plotted_window
+        d = await plot_df()
         d = d[d["model"].isin(input.models())]
+
+        # Only rebuild the whole figure (layout, threshold lines and all) when the set
+        # of models (or the kind of time axis) changes. Otherwise, just update the
+        # existing traces.
+        same_models = set(d["model"]) == {trace.name for trace in plot.widget.data}
+        if same_models and input.window() == plotted_window:
+            update_timeseries(plot.widget, d)
+            return
+
+        plotted_window = input.window()
+
+        # (Overwrite, since updating a figure with fewer/more traces than it has
+        # would otherwise recycle/drop traces)
         with plot.widget.batch_animate():
             fig = plot_timeseries(d)
-            plot.widget.update(layout=fig.layout, data=fig.data)
+            plot.widget.update(layout=fig.layout, data=fig.data, overwrite=True)
 
     # Hacky way to hide/show model value boxes. This is currently the only real
     # option you want the value box UI to be statically rendered (thus, reducing
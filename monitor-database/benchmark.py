@@ -0,0 +1,215 @@
+"""
+Load benchmark for the monitor-database app.
+
+Starts the app locally, drives the scoredata simulator at a chosen write rate, opens
+a number of headless sessions (speaking Shiny's websocket protocol directly, rather
+than running browsers), and reports:
+
+  * Update latency: time from new rows becoming visible in the database to each
+    session receiving the resulting update.
+  * Server CPU and memory, in total and per session (relative to an idle baseline).
+
+Example:
+
+    python benchmark.py --sessions 50 --rate 1000 --duration 30
+
+CPU and memory are read from /proc, so this only runs on Linux.
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import scoredata
+import websockets
+
+here = Path(__file__).parent
+
+MODELS = ["model_1", "model_2", "model_3", "model_4"]
+OUTPUTS = ["plot"] + [f"{m}-{o}" for m in MODELS for o in ("value", "icon")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=10, help="Number of sessions")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="Rows per second written by scoredata (0 for the default simulator)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Seconds to measure for"
+    )
+    parser.add_argument(
+        "--baseline", type=float, default=5, help="Seconds to measure idle usage for"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    return parser.parse_args()
+
+
+# ---------------------------------------------------------------
+# Server process stats (from /proc)
+# ---------------------------------------------------------------
+
+
+def cpu_secs(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        # The command name may contain spaces, so split after it
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime (fields 14 and 15 of the whole line)
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f"Couldn't read the memory usage of process {pid}")
+
+
+async def measure(pid, secs):
+    """CPU (as a percentage of one core) used by `pid` over `secs` seconds."""
+    start_cpu, start = cpu_secs(pid), time.monotonic()
+    await asyncio.sleep(secs)
+    return 100 * (cpu_secs(pid) - start_cpu) / (time.monotonic() - start)
+
+
+# ---------------------------------------------------------------
+# Database commits and session updates
+# ---------------------------------------------------------------
+
+
+class CommitWatcher(threading.Thread):
+    """
+    Polls the database (every `interval` seconds) in a background thread, recording
+    when each new batch of rows becomes visible.
+    """
+
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.times = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        last = None
+        while not self.stopped.is_set():
+            latest = scoredata.storage.last_modified()
+            if latest != last:
+                self.times.append(time.monotonic())
+                last = latest
+            time.sleep(self.interval)
+
+
+async def session(port, updates, ready):
+    """
+    Open a session (with all outputs visible), then record when each update to its
+    outputs arrives.
+    """
+    url = f"ws://127.0.0.1:{port}/websocket/"
+    async with websockets.connect(url, max_size=None) as ws:
+        init = {"models": MODELS, "pause": False, "window": "live"}
+        for output in OUTPUTS:
+            init[f".clientdata_output_{output}_hidden"] = False
+        await ws.send(json.dumps({"method": "init", "data": init}))
+
+        while True:
+            msg = json.loads(await ws.recv())
+            if msg.get("values"):
+                updates.append(time.monotonic())
+                ready.set()
+
+
+async def wait_for_port(port, timeout=60):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"The app didn't start listening on port {port}")
+
+
+def latencies(commits, updates):
+    """For each commit, the time until the next update to arrive after it."""
+    result = []
+    for commit in commits:
+        i = bisect.bisect_left(updates, commit)
+        if i < len(updates):
+            result.append(updates[i] - commit)
+    return result
+
+
+async def main(args):
+    env = {**os.environ, "SCOREDATA_WRITE_RATE": str(args.rate)}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "shiny", "run", "app-core.py", "--port", str(args.port)],
+        cwd=here,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    tasks = []
+    try:
+        await wait_for_port(args.port)
+
+        print(f"Measuring idle usage for {args.baseline}s...")
+        idle_cpu = await measure(server.pid, args.baseline)
+        idle_rss = rss_mb(server.pid)
+
+        print(f"Opening {args.sessions} sessions...")
+        updates = [[] for _ in range(args.sessions)]
+        ready = [asyncio.Event() for _ in range(args.sessions)]
+        for u, r in zip(updates, ready):
+            tasks.append(asyncio.create_task(session(args.port, u, r)))
+        await asyncio.wait_for(asyncio.gather(*(r.wait() for r in ready)), 120)
+
+        print(f"Measuring for {args.duration}s...")
+        watcher = CommitWatcher()
+        # A DuckDB database can't be read while the app has it open
+        if scoredata.BACKEND == "sqlite":
+            watcher.start()
+        start = time.monotonic()
+        load_cpu = await measure(server.pid, args.duration)
+        load_rss = rss_mb(server.pid)
+        watcher.stopped.set()
+    finally:
+        for task in tasks:
+            task.cancel()
+        server.terminate()
+        server.wait()
+
+    # Ignore commits in the last second, whose updates may not have arrived yet
+    commits = [t for t in watcher.times if start <= t <= start + args.duration - 1]
+    lat = [x for u in updates for x in latencies(commits, u)]
+    n = args.sessions
+
+    print()
+    print(f"Sessions: {n}, write rate: {args.rate or 'default'} rows/s")
+    if scoredata.BACKEND != "sqlite":
+        print(f"Update latency: not measured with the {scoredata.BACKEND} backend")
+    else:
+        print(f"Commits observed: {len(commits)}, updates measured: {len(lat)}")
+    if lat:
+        p50, p90, p99 = np.percentile(lat, [50, 90, 99]) * 1000
+        print(f"Update latency (ms): p50 {p50:.1f}, p90 {p90:.1f}, p99 {p99:.1f}")
+    print(f"Server CPU (% of a core): idle {idle_cpu:.1f}, loaded {load_cpu:.1f}")
+    print(f"  per session: {(load_cpu - idle_cpu) / n:.2f}")
+    print(f"Server memory (MB): idle {idle_rss:.1f}, loaded {load_rss:.1f}")
+    print(f"  per session: {(load_rss - idle_rss) / n:.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,58 +1,154 @@
 import asyncio
 import datetime
+import logging
+import os
 import random
-import sqlite3
+import threading
+import time
 from pathlib import Path
 
-import numpy as np
 import pandas as pd
+from storage import DuckDBStorage, SQLiteStorage
+
+logger = logging.getLogger(__name__)
 
 here = Path(__file__).parent
 accuracy_scores = pd.read_csv(here / "fake_accuracy_scores.csv")
 accuracy_scores.set_index("second", inplace=True)
 (here / "data").mkdir(exist_ok=True)
 
-SQLITE_DB_URI = f"file:{here / 'data' / 'accuracy_scores.sqlite'}"
+# Where to store the scores: "sqlite" (the default) or "duckdb"
+BACKEND = os.environ.get("SCOREDATA_BACKEND", "sqlite")
+if BACKEND == "duckdb":
+    storage = DuckDBStorage(here / "data" / "accuracy_scores.duckdb")
+else:
+    storage = SQLiteStorage(here / "data" / "accuracy_scores.sqlite")
+
+# Target number of rows to write per second. By default (0), one row per model is
+# written every 2-4 seconds, like a real scoring job would. Set this (e.g., to 10000)
+# to use the simulator as a load generator.
+WRITE_RATE = float(os.environ.get("SCOREDATA_WRITE_RATE", 0))
+# Buffered rows are written in a single transaction once there are this many of them,
+# or once this many seconds have passed since the last write
+BATCH_SIZE = int(os.environ.get("SCOREDATA_BATCH_SIZE", 1000))
+FLUSH_SECS = float(os.environ.get("SCOREDATA_FLUSH_SECS", 0.25))
+
+# (model, score) pairs for each second of the simulated hour
+scores_by_second = {
+    second: list(zip(d["model"], d["score"]))
+    for second, d in accuracy_scores.groupby(level="second")
+}
+
+# (event loop, async callback) pairs to notify after every insert
+_subscribers = []
+_subscribers_lock = threading.Lock()
+
+
+def subscribe(callback):
+    """
+    Register an async `callback` to be run on the caller's event loop whenever new
+    rows are written. Since the writer may be running on a different thread (and
+    event loop), the callback is always scheduled in a thread-safe way.
+    """
+    loop = asyncio.get_running_loop()
+    with _subscribers_lock:
+        _subscribers.append((loop, callback))
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Notifying a subscriber failed", exc_info=future.exception())
+
+
+def notify():
+    with _subscribers_lock:
+        subscribers = list(_subscribers)
+    for loop, callback in subscribers:
+        if not loop.is_closed():
+            future = asyncio.run_coroutine_threadsafe(callback(), loop)
+            future.add_done_callback(_log_failure)
 
 
 def init_db():
-    with sqlite3.connect(SQLITE_DB_URI, uri=True, timeout=30) as con:
-        con.execute("PRAGMA journal_mode=WAL")
-        con.execute("drop table if exists accuracy_scores")
-
-        now = datetime.datetime.now(datetime.timezone.utc)
-        position = now.minute * 60 + now.second + 1
-
-        # Simulate 100 seconds of historical data
-        offset_secs = -np.arange(100) - 1
-        abs_secs = (position + offset_secs) % (60 * 60) + 1
-        initial_scores = accuracy_scores.loc[abs_secs]
-        timestamps = pd.DataFrame(
-            {
-                "timestamp": now + pd.to_timedelta(offset_secs, unit="s"),
-                "second": abs_secs,
-            }
-        ).set_index("second", inplace=False)
-        initial_scores = initial_scores.join(timestamps, how="left")
-        initial_scores.to_sql("accuracy_scores", con, index=False, if_exists="append")
-
-        con.execute(
-            "create index idx_accuracy_scores_timestamp on accuracy_scores(timestamp)"
-        )
-
-        return position
-
-
-async def update_db(position):
-    with sqlite3.connect(SQLITE_DB_URI, uri=True, timeout=30) as con:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    position = now.minute * 60 + now.second + 1
+
+    # Simulate 100 seconds of historical data
+    rows = []
+    for offset_secs in range(-100, 0):
+        second = (position + offset_secs) % (60 * 60) + 1
+        timestamp = now + datetime.timedelta(seconds=offset_secs)
+        rows.extend(score_rows(second, timestamp))
+    storage.create(rows)
+
+    return position
+
+
+class BatchWriter:
+    """
+    Buffers rows in memory and inserts them (and updates the rollups) in a single
+    transaction, once `batch_size` rows are waiting or `flush_secs` have passed.
+    """
+
+    def __init__(self, storage, batch_size=BATCH_SIZE, flush_secs=FLUSH_SECS):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_secs = flush_secs
+        self.rows = []
+        self.last_flush = time.monotonic()
+
+    def append(self, rows):
+        self.rows.extend(rows)
+        if (
+            len(self.rows) >= self.batch_size
+            or time.monotonic() - self.last_flush >= self.flush_secs
+        ):
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.rows:
+            return
+        self.storage.append(self.rows)
+        self.rows = []
+        notify()
+
+
+def score_rows(position, timestamp):
+    return [(model, score, timestamp) for model, score in scores_by_second[position]]
+
+
+def next_position(position):
+    return (position % (60 * 60)) + 1
+
+
+async def update_db(position, rate=WRITE_RATE):
+    writer = BatchWriter(storage)
+
+    if not rate:
         while True:
-            new_data = accuracy_scores.loc[position].copy()
-            # del new_data["second"]
-            new_data["timestamp"] = datetime.datetime.now(datetime.timezone.utc)
-            new_data.to_sql("accuracy_scores", con, index=False, if_exists="append")
-            position = (position % (60 * 60)) + 1
+            now = datetime.datetime.now(datetime.timezone.utc)
+            writer.append(score_rows(position, now))
+            writer.flush()
+            position = next_position(position)
             await asyncio.sleep(random.randint(2, 4))
 
+    # Each tick writes one row per model, so space the ticks out to hit the target
+    # rate, catching up on any ticks that are due since the last wake-up. Every
+    # tick gets its own timestamp, even when many are written at once.
+    tick_secs = len(scores_by_second[position]) / rate
+    start = time.monotonic()
+    start_time = datetime.datetime.now(datetime.timezone.utc)
+    ticks = 0
+    while True:
+        due = int((time.monotonic() - start) / tick_secs)
+        while ticks < due:
+            timestamp = start_time + datetime.timedelta(seconds=ticks * tick_secs)
+            writer.append(score_rows(position, timestamp))
+            position = next_position(position)
+            ticks += 1
+        await asyncio.sleep(max(tick_secs, 0.01))
+
 
 def begin():
     position = init_db()
@@ -62,8 +158,11 @@ def begin():
     # task. (This is the case when running via `shiny run` and shinylive.) Otherwise, we
     # need to launch a background thread and run an asyncio event loop there. (This is
     # the case when running via shinyapps.io or Posit Connect.)
+    #
+    # When generating load, always use a background thread, so the writer doesn't
+    # compete with the app for time on its event loop.
 
-    if asyncio.get_event_loop().is_running():
+    if asyncio.get_event_loop().is_running() and not WRITE_RATE:
         asyncio.create_task(update_db(position))
     else:
         from threading import Thread
@@ -1,6 +1,9 @@
-import sqlite3
+import asyncio
+import datetime
+import logging
 
 import faicons as fa
+import numpy as np
 import pandas as pd
 import plotly.express as px
 
@@ -8,47 +11,243 @@ import plotly.express as px
 # You should replace it with a connection to your actual database.
 import scoredata
 from shiny import module, reactive, render, ui
+from storage import ROLLUPS
 
 scoredata.begin()
-con = sqlite3.connect(scoredata.SQLITE_DB_URI, uri=True)
+
+logger = logging.getLogger(__name__)
+
+# Where scores are read from (see `storage.py` for the available backends)
+storage = scoredata.storage
 
 
 def last_modified():
     """
     Fast-executing call to get the timestamp of the most recent row in the
-    database. We will poll against this in absence of a way to receive a push
-    notification when our SQLite database changes.
+    database. This is only used as a fallback for writers that don't send a push
+    notification (see `scoredata.subscribe()`) when they change the database.
     """
-    res = con.execute("select max(timestamp) from accuracy_scores")
-    return res.fetchone()[0]
+    return storage.last_modified()
 
 
-@reactive.poll(last_modified)
-def df():
+class ScoreBuffer:
     """
-    @reactive.poll calls a cheap query (`last_modified()`) every 1 second to
-    check if the expensive query (`df()`) should be run and downstream
-    calculations should be updated.
+    An in-memory tail of the `accuracy_scores` table holding at most `size` rows.
 
-    By declaring this reactive object at the top-level of the script instead of
-    in the server function, all sessions are sharing the same object, so the
-    expensive query is only run once no matter how many users are connected.
+    Rather than re-reading (and re-parsing) the whole window on every change, only
+    rows newer than the last one seen are fetched and appended, so the cost of a
+    refresh is proportional to the number of new rows.
+
+    The latest score of every model is kept up to date the same way (in `latest`),
+    so looking one up doesn't require scanning the tail.
     """
-    tbl = pd.read_sql(
-        "select * from accuracy_scores order by timestamp desc, model desc limit ?",
-        con,
-        params=[150],
+
+    def __init__(self, size: int):
+        self.size = size
+        self.tbl = pd.DataFrame(columns=["model", "score", "timestamp", "time"])
+        # Timestamp of the newest row in the buffer
+        self.last_seen = None
+        # Maps model -> most recent score
+        self.latest = {}
+
+    def refresh(self) -> pd.DataFrame:
+        if self.last_seen is None:
+            new = storage.read_tail(self.size)
+            # Models that haven't reported recently may not be in the tail, so look
+            # up every model's latest score
+            self.latest = storage.read_latest()
+        else:
+            new = storage.read_after(self.last_seen)
+
+        if new.empty:
+            return self.tbl
+
+        self.last_seen = new["timestamp"].iloc[-1]
+        # Later rows win, so this ends up with the latest score for each model. Build
+        # a new dict, so that previous results handed out by `latest_scores()` (e.g.,
+        # to paused sessions) don't change under their feet.
+        self.latest = {**self.latest, **dict(zip(new["model"], new["score"]))}
+        # Create a short label for readability
+        new["time"] = new["timestamp"].dt.strftime("%H:%M:%S")
+
+        tbl = new if self.tbl.empty else pd.concat([self.tbl, new])
+        self.tbl = tbl.tail(self.size).reset_index(drop=True)
+        return self.tbl
+
+
+buffer = ScoreBuffer(150)
+
+
+def read_new_rows():
+    return buffer.refresh()
+
+
+# How often to check the database for changes that weren't announced via a push
+# notification (e.g., rows written by another process)
+FALLBACK_POLL_SECS = 5
+
+# The tail of the table and the latest score for each model. By declaring these at
+# the top-level of the script instead of in the server function, all sessions are
+# sharing the same objects, so the query is only run once no matter how many users
+# are connected. The query itself only fetches rows that arrived since the previous
+# run.
+df = reactive.value(read_new_rows())
+latest_scores = reactive.value(buffer.latest)
+
+# Incremented whenever new rows arrive
+changes = reactive.value(0)
+
+# Only one refresh of the (stateful) buffer should be running at a time
+_refresh_lock = asyncio.Lock()
+
+
+async def refresh():
+    """
+    Read any new rows in a worker thread, then update `df` and friends. Since this
+    happens outside of the reactive graph, a slow query never holds up other
+    sessions: the event loop (and reactive lock) stay free while it runs.
+    """
+    async with _refresh_lock:
+        tbl = await asyncio.to_thread(read_new_rows)
+        with reactive.isolate():
+            if tbl is df.get():
+                return
+
+        # This runs outside of any session, so we need to take the reactive lock and
+        # flush ourselves for the invalidation to propagate right away
+        async with reactive.lock():
+            df.set(tbl)
+            latest_scores.set(buffer.latest)
+            with reactive.isolate():
+                changes.set(changes.get() + 1)
+            await reactive.flush()
+
+
+async def poll_fallback():
+    while True:
+        await asyncio.sleep(FALLBACK_POLL_SECS)
+        # Keep polling even if the database is (temporarily) unavailable
+        try:
+            if await asyncio.to_thread(last_modified) != buffer.last_seen:
+                await refresh()
+        except Exception:
+            logger.warning("Polling the database failed", exc_info=True)
+
+
+@reactive.effect
+def _():
+    # Effects run on the app's event loop, which may not be running yet when this
+    # module is imported. With no reactive dependencies, this only ever runs once.
+    #
+    # The scoredata writer notifies us as soon as it inserts new rows, and we poll
+    # `last_modified()` (less often) as a fallback.
+    scoredata.subscribe(refresh)
+    asyncio.create_task(poll_fallback())
+    # Catch up on anything written since the module was imported
+    asyncio.create_task(refresh())
+
+
+# ---------------------------------------------------------------
+# Longer time windows, read from the downsampled rollup tables
+# ---------------------------------------------------------------
+
+# Time windows (in seconds) that can be viewed in addition to the live tail in `df()`
+HISTORY_WINDOWS = {
+    "Last 15 minutes": 15 * 60,
+    "Last hour": 60 * 60,
+    "Last day": 24 * 60 * 60,
+    "Last week": 7 * 24 * 60 * 60,
+}
+# Show at most (about) this many points per model, like the live tail
+MAX_POINTS = 150
+# The database aggregates into this many times more buckets than points shown,
+# giving downsampling (see `lttb()`) some detail to choose from
+OVERSAMPLING = 4
+
+# The raw table and its rollups, by resolution (in seconds)
+SOURCES = [(0, "accuracy_scores")] + sorted(
+    (bucket_secs, table) for table, bucket_secs in ROLLUPS.items()
+)
+
+
+def source_table(window_secs: int, max_points: int) -> str:
+    """
+    Pick the coarsest resolution that still has at least `max_points` buckets in
+    `window_secs`.
+    """
+    for bucket_secs, table in reversed(SOURCES):
+        if bucket_secs <= window_secs / max_points:
+            return table
+    return SOURCES[0][1]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling: the indices of `n_out` points that
+    preserve the visual shape of the series. The first and last points are always
+    kept, and from each bucket in between, the point that forms the largest triangle
+    with the previously picked point and the average of the next bucket.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    picked = [0]
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = (hi, edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        ax, ay = x[picked[-1]], y[picked[-1]]
+        cx, cy = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        area = np.abs((ax - cx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (cy - ay))
+        picked.append(lo + int(area.argmax()))
+    picked.append(n - 1)
+    return np.array(picked)
+
+
+def read_history(window_secs: int, max_points: int = MAX_POINTS) -> pd.DataFrame:
+    """
+    Scores over the last `window_secs`, with at most `max_points` points per model.
+    The database averages scores into (a few times more than `max_points`) evenly
+    sized time buckets, and those are then downsampled with `lttb()`.
+    """
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        seconds=window_secs
     )
-    # Convert timestamp to datetime object, which SQLite doesn't support natively
-    tbl["timestamp"] = pd.to_datetime(tbl["timestamp"], utc=True)
-    # Create a short label for readability
-    tbl["time"] = tbl["timestamp"].dt.strftime("%H:%M:%S")
-    # Reverse order of rows
-    tbl = tbl.iloc[::-1]
+    tbl = storage.read_buckets(
+        source_table(window_secs, max_points),
+        since,
+        slot_secs=window_secs / (max_points * OVERSAMPLING),
+    )
+
+    secs = tbl["timestamp"].astype("int64").to_numpy() / 1e9
+    scores = tbl["score"].to_numpy()
+    keep = [
+        idx[lttb(secs[idx], scores[idx], max_points)]
+        for idx in tbl.groupby("model").indices.values()
+    ]
+    if keep:
+        tbl = tbl.iloc[np.sort(np.concatenate(keep))].reset_index(drop=True)
 
+    # After downsampling, points are irregularly spaced (and differ between models),
+    # so they need a real time axis rather than the live view's labels
+    tbl["time"] = tbl["timestamp"]
     return tbl
 
 
+def history_calc(window_secs: int):
+    @reactive.calc
+    async def history():
+        changes()
+        return await asyncio.to_thread(read_history, window_secs)
+
+    return history
+
+
+# Like `df()`, these are shared by all sessions
+history_dfs = {secs: history_calc(secs) for secs in HISTORY_WINDOWS.values()}
+
+
 # ---------------------------------------------------------------
 # Plot and value box logic
 # ---------------------------------------------------------------
@@ -69,11 +268,10 @@ def value_box_ui(title):
 
 
 @module.server
-def value_box_server(input, output, session, df, model: str):
+def value_box_server(input, output, session, latest, model: str):
     @reactive.calc
     def score():
-        d = df()
-        return d[d["model"] == model].iloc[-1]["score"]
+        return latest()[model]
 
     @render.text
     def value():
@@ -121,3 +319,16 @@ def plot_timeseries(d):
     fig.update_layout(hovermode="x unified")
 
     return fig
+
+
+def update_timeseries(widget, d):
+    """
+    Point the existing (per-model) traces of a `plot_timeseries()` figure at the new
+    data, rather than building a new figure. Plotly only sends the trace data that
+    actually changed to the browser, and the layout isn't touched.
+    """
+    groups = dict(tuple(d.groupby("model")))
+    with widget.batch_animate():
+        for trace in widget.data:
+            points = groups[trace.name]
+            trace.update(x=points["time"], y=points["score"])
@@ -0,0 +1,339 @@
+import datetime
+import math
+import queue
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+# Downsampled copies of the (roughly 1 row/second) `accuracy_scores` table, which hold
+# the count, sum, min and max of each model's scores per time bucket.
+# Maps table name -> bucket size in seconds
+ROLLUPS = {
+    "accuracy_scores_10s": 10,
+    "accuracy_scores_1m": 60,
+    "accuracy_scores_1h": 60 * 60,
+}
+
+
+def rollup_rows(rows, bucket_secs):
+    """
+    Aggregate (model, score, timestamp) rows into (model, bucket, n, sum, min, max)
+    rows, where `bucket` is the start of the `bucket_secs` long bucket.
+    """
+    buckets = {}
+    for model, score, timestamp in rows:
+        start = math.floor(timestamp.timestamp() / bucket_secs) * bucket_secs
+        key = (model, start)
+        agg = buckets.get(key)
+        if agg is None:
+            buckets[key] = [1, score, score, score]
+        else:
+            agg[0] += 1
+            agg[1] += score
+            agg[2] = min(agg[2], score)
+            agg[3] = max(agg[3], score)
+
+    return [
+        (model, datetime.datetime.fromtimestamp(start, datetime.timezone.utc), *agg)
+        for (model, start), agg in buckets.items()
+    ]
+
+
+class Storage(ABC):
+    """
+    Where scores (and their rollups) are kept. The writer in `scoredata.py` and the
+    readers in `shared.py` only talk to this interface, so the database can be
+    swapped out by implementing it.
+
+    Rows are written as (model, score, timestamp) tuples, with timezone-aware
+    `datetime` timestamps. Reads return data frames with a UTC `timestamp` column.
+    """
+
+    @abstractmethod
+    def create(self, rows):
+        """(Re)create the tables, starting with the given rows."""
+
+    @abstractmethod
+    def append(self, rows):
+        """Insert rows, and fold them into the rollups, in a single transaction."""
+
+    @abstractmethod
+    def last_modified(self) -> pd.Timestamp:
+        """The timestamp of the most recent row."""
+
+    @abstractmethod
+    def read_tail(self, n: int) -> pd.DataFrame:
+        """The `n` most recent rows, oldest first."""
+
+    @abstractmethod
+    def read_after(self, timestamp: pd.Timestamp) -> pd.DataFrame:
+        """All rows more recent than `timestamp`, oldest first."""
+
+    @abstractmethod
+    def read_latest(self) -> dict:
+        """The most recent score of every model."""
+
+    @abstractmethod
+    def read_buckets(
+        self, table: str, since: datetime.datetime, slot_secs: float
+    ) -> pd.DataFrame:
+        """
+        Scores from `table` (the raw table or a rollup) since `since`, averaged into
+        `slot_secs` long slots, with the min and max score of each slot.
+        """
+
+
+class SQLiteStorage(Storage):
+    """
+    Scores in a SQLite database. SQLite has no timestamp type, so timestamps are
+    stored as (sortable) ISO 8601 strings and parsed when read. Reads go through a
+    small pool of read-only connections, so they can run in worker threads.
+    """
+
+    def __init__(self, path: Path, pool_size: int = 4):
+        self.uri = f"file:{path}"
+        self.pool_size = pool_size
+        self._write_con = None
+        self._pool = None
+
+    @staticmethod
+    def _format(timestamp) -> str:
+        return timestamp.isoformat(" ", timespec="microseconds")
+
+    def create(self, rows):
+        with sqlite3.connect(self.uri, uri=True, timeout=30) as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("drop table if exists accuracy_scores")
+            con.execute(
+                "create table accuracy_scores "
+                "(model TEXT, score REAL, timestamp TIMESTAMP)"
+            )
+            con.execute(
+                "create index idx_accuracy_scores_timestamp "
+                "on accuracy_scores(timestamp)"
+            )
+            for table in ROLLUPS:
+                con.execute(f"drop table if exists {table}")
+                con.execute(
+                    f"create table {table} (model TEXT, bucket TIMESTAMP, n INTEGER, "
+                    "score_sum REAL, score_min REAL, score_max REAL, "
+                    "primary key (model, bucket))"
+                )
+        self.append(rows)
+
+    def append(self, rows):
+        if self._write_con is None:
+            # Only the (single) writer thread uses this connection
+            self._write_con = sqlite3.connect(
+                self.uri, uri=True, timeout=30, check_same_thread=False
+            )
+        con = self._write_con
+        with con:
+            con.executemany(
+                "insert into accuracy_scores (model, score, timestamp) values (?, ?, ?)",
+                [(m, s, self._format(ts)) for m, s, ts in rows],
+            )
+            for table, bucket_secs in ROLLUPS.items():
+                con.executemany(
+                    f"insert into {table} values (?, ?, ?, ?, ?, ?) "
+                    "on conflict (model, bucket) do update set "
+                    "n = n + excluded.n, "
+                    "score_sum = score_sum + excluded.score_sum, "
+                    "score_min = min(score_min, excluded.score_min), "
+                    "score_max = max(score_max, excluded.score_max)",
+                    [
+                        (m, self._format(b), *agg)
+                        for m, b, *agg in rollup_rows(rows, bucket_secs)
+                    ],
+                )
+
+    @contextmanager
+    def connection(self):
+        if self._pool is None:
+            self._pool = queue.Queue()
+            for _ in range(self.pool_size):
+                self._pool.put(
+                    sqlite3.connect(
+                        f"{self.uri}?mode=ro", uri=True, check_same_thread=False
+                    )
+                )
+        con = self._pool.get()
+        try:
+            yield con
+        finally:
+            self._pool.put(con)
+
+    def _read(self, query, params) -> pd.DataFrame:
+        with self.connection() as con:
+            tbl = pd.read_sql(query, con, params=params)
+        # Convert timestamp to datetime object, which SQLite doesn't support natively
+        tbl["timestamp"] = pd.to_datetime(tbl["timestamp"], utc=True)
+        return tbl
+
+    def last_modified(self):
+        with self.connection() as con:
+            res = con.execute("select max(timestamp) from accuracy_scores")
+            return pd.Timestamp(res.fetchone()[0])
+
+    def read_tail(self, n):
+        tbl = self._read(
+            "select * from accuracy_scores order by timestamp desc, model desc limit ?",
+            [n],
+        )
+        # Reverse order of rows
+        return tbl.iloc[::-1].reset_index(drop=True)
+
+    def read_after(self, timestamp):
+        return self._read(
+            "select * from accuracy_scores where timestamp > ? order by timestamp, model",
+            [self._format(timestamp)],
+        )
+
+    def read_latest(self):
+        with self.connection() as con:
+            # SQLite takes `score` from the row with the max timestamp
+            res = con.execute(
+                "select model, score, max(timestamp) from accuracy_scores group by model"
+            )
+            return {model: score for model, score, _ in res.fetchall()}
+
+    def read_buckets(self, table, since, slot_secs):
+        if table in ROLLUPS:
+            ts, score, lo, hi = (
+                "bucket",
+                "sum(score_sum) / sum(n)",
+                "score_min",
+                "score_max",
+            )
+        else:
+            ts, score, lo, hi = "timestamp", "avg(score)", "score", "score"
+
+        return self._read(
+            f"select model, min({ts}) as timestamp, {score} as score, "
+            f"min({lo}) as score_min, max({hi}) as score_max from {table} "
+            f"where {ts} >= :since "
+            f"group by model, cast((julianday({ts}) - julianday(:since)) "
+            "* 86400 / :slot_secs as integer) "
+            "order by timestamp, model",
+            {"since": self._format(since), "slot_secs": slot_secs},
+        )
+
+
+class DuckDBStorage(Storage):
+    """
+    Scores in a DuckDB database: a columnar engine with native timestamps, which is
+    much faster at analytic (e.g., time bucketed) queries over many rows. Requires
+    the `duckdb` package.
+
+    DuckDB only lets one process open a database file for writing, so (unlike the
+    SQLite database) it can't be read by other processes while the app is running.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._con = None
+
+    @contextmanager
+    def connection(self):
+        if self._con is None:
+            import duckdb
+
+            self._con = duckdb.connect(str(self.path))
+        # Each thread needs its own cursor (i.e., connection to the same database)
+        cur = self._con.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+    def create(self, rows):
+        with self.connection() as con:
+            con.execute(
+                "create or replace table accuracy_scores "
+                "(model VARCHAR, score DOUBLE, timestamp TIMESTAMPTZ)"
+            )
+            for table in ROLLUPS:
+                con.execute(
+                    f"create or replace table {table} (model VARCHAR, "
+                    "bucket TIMESTAMPTZ, n INTEGER, score_sum DOUBLE, "
+                    "score_min DOUBLE, score_max DOUBLE, primary key (model, bucket))"
+                )
+        self.append(rows)
+
+    def append(self, rows):
+        new_rows = pd.DataFrame(rows, columns=["model", "score", "timestamp"])
+        with self.connection() as con:
+            con.begin()
+            con.register("new_rows", new_rows)
+            con.execute("insert into accuracy_scores select * from new_rows")
+            for table, bucket_secs in ROLLUPS.items():
+                con.execute(
+                    f"insert into {table} select model, "
+                    f"to_timestamp(floor(epoch(timestamp) / {bucket_secs}) "
+                    f"* {bucket_secs}) as bucket, "
+                    "count(*), sum(score), min(score), max(score) "
+                    "from new_rows group by model, bucket "
+                    "on conflict (model, bucket) do update set "
+                    "n = n + excluded.n, "
+                    "score_sum = score_sum + excluded.score_sum, "
+                    "score_min = least(score_min, excluded.score_min), "
+                    "score_max = greatest(score_max, excluded.score_max)"
+                )
+            con.commit()
+
+    def _read(self, query, params) -> pd.DataFrame:
+        with self.connection() as con:
+            tbl = con.execute(query, params).df()
+        # Timestamps come back in the session's time zone
+        tbl["timestamp"] = tbl["timestamp"].dt.tz_convert("UTC")
+        return tbl
+
+    def last_modified(self):
+        # (Going through a data frame, since fetching timestamps as Python objects
+        # requires `pytz`)
+        tbl = self._read("select max(timestamp) as timestamp from accuracy_scores", [])
+        return tbl["timestamp"].iloc[0]
+
+    def read_tail(self, n):
+        tbl = self._read(
+            "select * from accuracy_scores order by timestamp desc, model desc limit ?",
+            [n],
+        )
+        return tbl.iloc[::-1].reset_index(drop=True)
+
+    def read_after(self, timestamp):
+        return self._read(
+            "select * from accuracy_scores where timestamp > ? order by timestamp, model",
+            [timestamp.to_pydatetime()],
+        )
+
+    def read_latest(self):
+        with self.connection() as con:
+            res = con.execute(
+                "select model, arg_max(score, timestamp) from accuracy_scores "
+                "group by model"
+            )
+            return dict(res.fetchall())
+
+    def read_buckets(self, table, since, slot_secs):
+        if table in ROLLUPS:
+            ts, score, lo, hi = (
+                "bucket",
+                "sum(score_sum) / sum(n)",
+                "score_min",
+                "score_max",
+            )
+        else:
+            ts, score, lo, hi = "timestamp", "avg(score)", "score", "score"
+
+        return self._read(
+            f"select model, min({ts}) as timestamp, {score} as score, "
+            f"min({lo}) as score_min, max({hi}) as score_max from {table} "
+            f"where {ts} >= $since "
+            f"group by model, floor((epoch({ts}) - epoch($since)) / $slot_secs) "
+            "order by timestamp, model",
+            {"since": since, "slot_secs": slot_secs},
+        )
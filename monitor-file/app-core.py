@@ -1,10 +1,23 @@
-import pandas as pd
 from faicons import icon_svg
 
 # Import the reactive file reader (logs) and the process the external
 # process that generates the logs
-from shared import logs_df, process
+from shared import (
+    log_page,
+    logs_df,
+    message_counts_df,
+    page_count,
+    plot_rates,
+    plot_statuses,
+    process,
+    search_logs,
+    trends_dfs,
+    update_bars,
+)
 from shiny import App, Inputs, Outputs, Session, reactive, render, ui
+from shinywidgets import output_widget, render_plotly
+
+TREND_CHOICES = {"minute": "Per minute (last hour)", "hour": "Per hour (last day)"}
 
 app_ui = ui.page_fillable(
     ui.layout_columns(
@@ -33,8 +46,22 @@ app_ui = ui.page_fillable(
     ),
     ui.layout_columns(
         ui.card(
-            ui.card_header("Logs"),
+            ui.card_header(
+                "Logs",
+                ui.input_text("search", None, placeholder="Search logs..."),
+                class_="d-flex justify-content-between align-items-center",
+            ),
             ui.output_data_frame("df"),
+            ui.card_footer(
+                ui.input_action_button(
+                    "newer", "Newer", icon=icon_svg("chevron-left"), class_="btn-sm"
+                ),
+                ui.output_text("page_info"),
+                ui.input_action_button(
+                    "older", "Older", icon=icon_svg("chevron-right"), class_="btn-sm"
+                ),
+                class_="d-flex justify-content-between align-items-center",
+            ),
         ),
         ui.card(
             ui.card_header("Log Summary"),
@@ -42,14 +69,70 @@ app_ui = ui.page_fillable(
         ),
         col_widths=[8, 4],
     ),
+    ui.layout_columns(
+        ui.card(
+            ui.card_header(
+                "Message Rate",
+                ui.input_radio_buttons("trend", None, TREND_CHOICES, inline=True),
+                class_="d-flex justify-content-between align-items-center",
+            ),
+            output_widget("rate_plot"),
+        ),
+        ui.card(
+            ui.card_header("Status Distribution"),
+            output_widget("status_plot"),
+        ),
+        col_widths=[8, 4],
+    ),
     class_="bslib-page-dashboard",
 )
 
 
 def server(input: Inputs, output: Outputs, session: Session):
+    # Only the current page of logs (newest first) is sent to the browser
+    page = reactive.value(0)
+
+    @reactive.calc
+    def matches():
+        # Positions of the rows matching the search, or None to show all of them
+        return search_logs(logs_df(), input.search())
+
+    @reactive.calc
+    def n_rows():
+        return len(logs_df()) if matches() is None else len(matches())
+
+    @reactive.calc
+    def n_pages():
+        return page_count(n_rows())
+
+    @reactive.calc
+    def cur_page():
+        # The log may have been truncated since the page was picked
+        return min(page(), n_pages() - 1)
+
+    @reactive.effect
+    @reactive.event(input.newer)
+    def _():
+        page.set(max(cur_page() - 1, 0))
+
+    @reactive.effect
+    @reactive.event(input.older)
+    def _():
+        page.set(min(cur_page() + 1, n_pages() - 1))
+
+    @reactive.effect
+    @reactive.event(input.search)
+    def _():
+        page.set(0)
+
     @render.data_frame
     def df():
-        return logs_df().sort_values("date", ascending=False)
+        return log_page(logs_df(), cur_page(), matches())
+
+    @render.text
+    def page_info():
+        rows = "rows" if matches() is None else "matching rows"
+        return f"Page {cur_page() + 1} of {n_pages()} ({n_rows()} {rows})"
 
     @reactive.calc
     def current():
@@ -57,8 +140,7 @@ def server(input: Inputs, output: Outputs, session: Session):
 
     @render.text
     def last_update():
-        dates = pd.to_datetime(current()["date"])
-        return dates.strftime("%H:%M:%S")
+        return current()["date"].strftime("%H:%M:%S")
 
     @render.text
     def n_messages():
@@ -74,10 +156,29 @@ def server(input: Inputs, output: Outputs, session: Session):
 
     @render.data_frame
     def message_counts():
-        counts = logs_df()["message"].value_counts().reset_index()
-        counts.columns = ["message", "count"]
-        counts = counts.sort_values("count", ascending=False)
-        return render.DataGrid(counts, filters=True)
+        return render.DataGrid(message_counts_df(), filters=True)
+
+    # The figures are only rebuilt when the resolution changes...
+    @render_plotly
+    def rate_plot():
+        trend = input.trend()
+        with reactive.isolate():
+            rates, _ = trends_dfs()[trend]
+        return plot_rates(rates)
+
+    @render_plotly
+    def status_plot():
+        trend = input.trend()
+        with reactive.isolate():
+            _, statuses = trends_dfs()[trend]
+        return plot_statuses(statuses)
+
+    # ...otherwise, their data is updated in place
+    @reactive.effect
+    def _():
+        rates, statuses = trends_dfs()[input.trend()]
+        update_bars(rate_plot.widget, rates["time"], rates["count"])
+        update_bars(status_plot.widget, statuses["share"], statuses["status"])
 
     session.on_ended(process.kill)
 
@@ -1,11 +1,24 @@
-import pandas as pd
 from faicons import icon_svg
 
 # Import the reactive file reader (logs) and the process the external
 # process that generates the logs
-from shared import logs_df, process
+from shared import (
+    log_page,
+    logs_df,
+    message_counts_df,
+    page_count,
+    plot_rates,
+    plot_statuses,
+    process,
+    search_logs,
+    trends_dfs,
+    update_bars,
+)
 from shiny import reactive
-from shiny.express import render, session, ui
+from shiny.express import input, render, session, ui
+from shinywidgets import render_plotly
+
+TREND_CHOICES = {"minute": "Per minute (last hour)", "hour": "Per hour (last day)"}
 
 ui.page_opts(fillable=True)
 
@@ -31,8 +44,7 @@ with ui.layout_columns(col_widths=[6, 2, 2, 2], fill=False):
 
         @render.text
         def last_update():
-            dates = pd.to_datetime(current()["date"])
-            return dates.strftime("%H:%M:%S")
+            return current()["date"].strftime("%H:%M:%S")
 
     with ui.value_box(showcase=icon_svg("envelope")):
         "Number of Messages"
@@ -44,21 +56,59 @@ with ui.layout_columns(col_widths=[6, 2, 2, 2], fill=False):
 
 with ui.layout_columns(col_widths=[8, 4]):
     with ui.card():
-        ui.card_header("Logs")
+        with ui.card_header(class_="d-flex justify-content-between align-items-center"):
+            "Logs"
+            ui.input_text("search", None, placeholder="Search logs...")
 
         @render.data_frame
         def df():
-            return logs_df().sort_values("date", ascending=False)
+            return log_page(logs_df(), cur_page(), matches())
+
+        with ui.card_footer(class_="d-flex justify-content-between align-items-center"):
+            ui.input_action_button(
+                "newer", "Newer", icon=icon_svg("chevron-left"), class_="btn-sm"
+            )
+
+            @render.text
+            def page_info():
+                rows = "rows" if matches() is None else "matching rows"
+                return f"Page {cur_page() + 1} of {n_pages()} ({n_rows()} {rows})"
+
+            ui.input_action_button(
+                "older", "Older", icon=icon_svg("chevron-right"), class_="btn-sm"
+            )
 
     with ui.card():
         ui.card_header("Log Summary")
 
         @render.data_frame
         def message_counts():
-            counts = logs_df()["message"].value_counts().reset_index()
-            counts.columns = ["message", "count"]
-            counts = counts.sort_values("count", ascending=False)
-            return render.DataGrid(counts, filters=True)
+            return render.DataGrid(message_counts_df(), filters=True)
+
+
+with ui.layout_columns(col_widths=[8, 4]):
+    with ui.card():
+        with ui.card_header(class_="d-flex justify-content-between align-items-center"):
+            "Message Rate"
+            ui.input_radio_buttons("trend", None, TREND_CHOICES, inline=True)
+
+        # The figures are only rebuilt when the resolution changes...
+        @render_plotly
+        def rate_plot():
+            trend = input.trend()
+            with reactive.isolate():
+                rates, _ = trends_dfs()[trend]
+            return plot_rates(rates)
+
+    with ui.card():
+        ui.card_header("Status Distribution")
+
+        @render_plotly
+        def status_plot():
+            trend = input.trend()
+            with reactive.isolate():
+                _, statuses = trends_dfs()[trend]
+            return plot_statuses(statuses)
 
 
 @reactive.calc
@@ -66,4 +116,56 @@ def current():
     return logs_df().iloc[-1]
 
 
+# ...otherwise, their data is updated in place
+@reactive.effect
+def _():
+    rates, statuses = trends_dfs()[input.trend()]
+    update_bars(rate_plot.widget, rates["time"], rates["count"])
+    update_bars(status_plot.widget, statuses["share"], statuses["status"])
+
+
+# Only the current page of logs (newest first) is sent to the browser
+page = reactive.value(0)
+
+
+@reactive.calc
+def matches():
+    # Positions of the rows matching the search, or None to show all of them
+    return search_logs(logs_df(), input.search())
+
+
+@reactive.calc
+def n_rows():
+    return len(logs_df()) if matches() is None else len(matches())
+
+
+@reactive.calc
+def n_pages():
+    return page_count(n_rows())
+
+
+@reactive.calc
+def cur_page():
+    # The log may have been truncated since the page was picked
+    return min(page(), n_pages() - 1)
+
+
+@reactive.effect
+@reactive.event(input.newer)
+def _():
+    page.set(max(cur_page() - 1, 0))
+
+
+@reactive.effect
+@reactive.event(input.older)
+def _():
+    page.set(min(cur_page() + 1, n_pages() - 1))
+
+
+@reactive.effect
+@reactive.event(input.search)
+def _():
+    page.set(0)
+
+
 _ = session.on_ended(process.kill)
@@ -1,40 +1,108 @@
+import csv
+import os
 import random
+import sys
 import time
 from datetime import datetime
 from pathlib import Path
 
-import pandas as pd
+# The log to write to, relative to this script (`logs.csv` by default). To simulate
+# several worker processes, run more copies of this script with other file names that
+# match the app's `LOGS_GLOB`, e.g., `python populate-logs.py logs-2.csv`.
+log_path = Path(__file__).parent / (sys.argv[1] if len(sys.argv) > 1 else "logs.csv")
 
-log_path = Path(__file__).parent / "logs.csv"
+# Target number of rows to write per second. By default (0), one row is written every
+# 1-5 seconds. Set this (e.g., to 1000) to use this script as a load generator.
+WRITE_RATE = float(os.environ.get("LOGS_WRITE_RATE", 0))
+# Once the log has this many rows, it's rotated: logs.csv is renamed to logs.1.csv
+# (logs.1.csv to logs.2.csv, and so on) and a new logs.csv is started
+MAX_ROWS = int(os.environ.get("LOGS_MAX_ROWS", 10000))
+# Number of rotated segments to keep around
+KEEP_SEGMENTS = int(os.environ.get("LOGS_KEEP_SEGMENTS", 5))
 
-while True:
-    status = "status" + str(random.randint(0, 20))
-    # Create a new DataFrame with the current time and the random status
-    messages = [
-        "Running smoothly",
-        "On fire",
-        "Taking a nap",
-        "Feeling happy",
-        "Feeling sad",
-        "Server is plotting world domination",
-        "Server is questioning its existence",
-        "Server is craving for digital pizza",
-        "Server is dreaming of electric sheep",
-        "Server is running on pure caffeine",
-    ]
-    message = random.choice(messages)
-    df = pd.DataFrame(
-        {"date": [datetime.now()], "status": [status], "message": [message]}
-    )
-
-    if not log_path.exists():
-        df.to_csv(log_path, mode="w", header=True, index=False)
-    else:
-        df_current = pd.read_csv(log_path)
-        # If we get over 10000 rows, just start over
-        if len(df_current) > 10000:
-            df.to_csv(log_path, mode="w", header=True, index=False)
+messages = [
+    "Running smoothly",
+    "On fire",
+    "Taking a nap",
+    "Feeling happy",
+    "Feeling sad",
+    "Server is plotting world domination",
+    "Server is questioning its existence",
+    "Server is craving for digital pizza",
+    "Server is dreaming of electric sheep",
+    "Server is running on pure caffeine",
+]
+
+
+def segment_path(i):
+    return log_path.with_name(f"{log_path.stem}.{i}{log_path.suffix}")
+
+
+def rotate():
+    if KEEP_SEGMENTS < 1:
+        log_path.unlink()
+        return
+    segment_path(KEEP_SEGMENTS).unlink(missing_ok=True)
+    for i in range(KEEP_SEGMENTS - 1, 0, -1):
+        if segment_path(i).exists():
+            os.replace(segment_path(i), segment_path(i + 1))
+    os.replace(log_path, segment_path(1))
+
+
+class LogWriter:
+    """
+    Appends rows to the log, keeping count of them (rather than re-reading the
+    file) to know when to rotate it.
+    """
+
+    def __init__(self):
+        if log_path.exists():
+            # Only counted once, on startup
+            with open(log_path, "rb") as f:
+                self.n_rows = sum(1 for _ in f) - 1
+            self.file = open(log_path, "a", newline="")
+            self.writer = csv.writer(self.file, lineterminator="\n")
         else:
-            df.to_csv(log_path, mode="a", header=False, index=False)
-    # Wait for a second before the next append operation
-    time.sleep(random.randint(1, 5))
+            self.start()
+
+    def start(self):
+        self.file = open(log_path, "w", newline="")
+        self.writer = csv.writer(self.file, lineterminator="\n")
+        self.writer.writerow(["date", "status", "message"])
+        self.n_rows = 0
+
+    def append(self):
+        if self.n_rows >= MAX_ROWS:
+            self.file.close()
+            rotate()
+            self.start()
+
+        status = "status" + str(random.randint(0, 20))
+        message = random.choice(messages)
+        date = datetime.now().isoformat(" ", timespec="microseconds")
+        self.writer.writerow([date, status, message])
+        self.n_rows += 1
+
+    def flush(self):
+        self.file.flush()
+
+
+log = LogWriter()
+
+if not WRITE_RATE:
+    while True:
+        log.append()
+        log.flush()
+        # Wait for a second before the next append operation
+        time.sleep(random.randint(1, 5))
+
+# Write however many rows are due since the last wake-up, then flush them together
+start = time.monotonic()
+written = 0
+while True:
+    due = int((time.monotonic() - start) * WRITE_RATE)
+    while written < due:
+        log.append()
+        written += 1
+    log.flush()
+    time.sleep(max(1 / WRITE_RATE, 0.01))
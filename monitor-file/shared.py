@@ -1,23 +1,653 @@
+import asyncio
+import bisect
+import copy
+import csv
+import heapq
+import io
+import logging
+import math
+import os
+import re
 import subprocess
+import threading
+import time
+from collections import Counter
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import plotly.express as px
 from shiny import reactive
 from shiny.session import session_context
 
+logger = logging.getLogger(__name__)
+
 app_dir = Path(__file__).parent
 
 # Launch process to generate logs
 process = subprocess.Popen(["python", app_dir / "populate-logs.py"])
 
 
-# File reader polls the file (every second by default) for changes
-#
+# Time resolutions of the trends kept by `LogTail`:
+# name -> (bucket size in seconds, number of buckets in the window)
+TRENDS = {
+    "minute": (60, 60),
+    "hour": (60 * 60, 24),
+}
+
+
+class LogIndex:
+    """
+    An inverted index over some (categorical) columns of the log: for each word,
+    the positions of the rows containing it. It's updated with only the new rows as
+    they're read, so searching never has to scan the log.
+
+    Positions count from the first row ever read, so they don't change when the
+    oldest rows are dropped (see `drop_before()`).
+    """
+
+    def __init__(self, columns: list[str]):
+        self.columns = columns
+        # Maps word -> list of arrays of row positions
+        self.postings = {}
+        # Rows before `first_row` have been dropped
+        self.first_row = 0
+        self.n_rows = 0
+        # Reads happen in a worker thread, while searches happen on the event loop
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def words(text: str) -> list[str]:
+        return re.findall(r"\w+", text.lower())
+
+    def add(self, new: pd.DataFrame, start: int):
+        """Index the rows of `new`, which start at row `start` of the log."""
+        with self.lock:
+            for col in self.columns:
+                # Every row with the same value has the same words
+                for value, rows in new.groupby(col, observed=True).indices.items():
+                    for word in set(self.words(str(value))):
+                        self.postings.setdefault(word, []).append(rows + start)
+            self.n_rows = start + len(new)
+
+    def drop_before(self, first: int):
+        """Forget the rows before position `first`."""
+        with self.lock:
+            if first <= self.first_row:
+                return
+            for word in list(self.postings):
+                rows = self._rows(word)
+                rows = rows[rows >= first]
+                if len(rows):
+                    self.postings[word] = [rows]
+                else:
+                    del self.postings[word]
+            self.first_row = first
+
+    def _rows(self, word: str) -> np.ndarray:
+        chunks = self.postings[word]
+        if len(chunks) > 1:
+            # Consolidate, so this is only done once per word and batch of rows
+            chunks[:] = [np.concatenate(chunks)]
+        return chunks[0]
+
+    def search(self, query: str) -> np.ndarray:
+        """
+        Positions of the rows (in ascending order) that contain, for every word in
+        `query`, a word starting with it.
+        """
+        found = None
+        with self.lock:
+            for term in self.words(query):
+                # Marking rows in a mask is much faster than merging sorted arrays
+                mask = np.zeros(self.n_rows - self.first_row, dtype=bool)
+                for word in self.postings:
+                    if word.startswith(term):
+                        mask[self._rows(word) - self.first_row] = True
+                found = mask if found is None else found & mask
+            first_row = self.first_row
+        if found is None:
+            return np.array([], dtype=int)
+        return np.flatnonzero(found) + first_row
+
+
+class RollingCounts:
+    """
+    The number of rows with each status in every `bucket_secs` long time bucket, for
+    the most recent `n_buckets` buckets (a window that ends at the current time, so
+    that a log that has gone quiet shows up as such). Counts are updated with only
+    the new rows, and older buckets are dropped as the window moves on, so keeping
+    them up to date costs the same however long the log gets.
+    """
+
+    def __init__(self, bucket_secs: int, n_buckets: int):
+        self.freq = pd.Timedelta(seconds=bucket_secs)
+        self.n_buckets = n_buckets
+        # Maps bucket start -> Counter of status -> number of rows
+        self.buckets = {}
+        # Reads happen in a worker thread, while lookups happen on the event loop
+        self.lock = threading.Lock()
+
+    def _last_bucket(self) -> pd.Timestamp:
+        # (Log dates are local times. Rows stamped slightly ahead of this process's
+        # clock still count.)
+        now = pd.Timestamp.now().floor(self.freq)
+        return max(now, max(self.buckets)) if self.buckets else now
+
+    def _drop_old(self) -> pd.Timestamp:
+        last = self._last_bucket()
+        first = last - (self.n_buckets - 1) * self.freq
+        for start in [start for start in self.buckets if start < first]:
+            del self.buckets[start]
+        return last
+
+    def add(self, new: pd.DataFrame):
+        starts = new["date"].dt.floor(self.freq)
+        counts = new.groupby([starts, "status"], observed=True).size()
+        with self.lock:
+            for (start, status), n in counts.items():
+                self.buckets.setdefault(start, Counter())[status] += n
+            self._drop_old()
+
+    def rates(self) -> pd.DataFrame:
+        """Number of rows in each bucket of the window (including empty ones)."""
+        with self.lock:
+            last = self._drop_old()
+            times = pd.date_range(end=last, periods=self.n_buckets, freq=self.freq)
+            counts = [sum(self.buckets.get(t, {}).values()) for t in times]
+        return pd.DataFrame({"time": times, "count": counts})
+
+    def statuses(self) -> pd.DataFrame:
+        """Share of the rows in the window with each status, most common first."""
+        with self.lock:
+            self._drop_old()
+            total = sum(self.buckets.values(), Counter())
+        tbl = pd.DataFrame(total.most_common(), columns=["status", "count"])
+        tbl["share"] = tbl["count"] / tbl["count"].sum()
+        return tbl
+
+
+def is_segment(path: Path) -> bool:
+    """Whether `path` is a rotated segment of a log (e.g., `logs.1.csv`)."""
+    return path.stem.rsplit(".", 1)[-1].isdigit() and "." in path.stem
+
+
+class FileTail:
+    """
+    Follows a CSV file that is only ever appended to, like `tail -F`.
+
+    The byte offset of the end of the last complete line read is remembered, so
+    each `read()` only returns the lines appended since.
+
+    When the file is rotated (`logs.csv` is renamed to `logs.1.csv`, and so on, and
+    a new `logs.csv` is started), the rest of the old file, and any segments rotated
+    after it, are read before moving on to the new file, so no lines are lost. If
+    the file is truncated or rewritten in place instead, `truncated` is set, and
+    it's read again from the start.
+    """
+
+    # Number of bytes at the start of the file used to recognize it
+    SIGNATURE_BYTES = 256
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.header = None
+        self.offset = 0
+        # (inode, first bytes) of the file being followed
+        self.identity = None
+        self.truncated = False
+
+    def segments(self) -> list[Path]:
+        """Rotated segments of the file (e.g., `logs.2.csv`, `logs.1.csv`), oldest first."""
+        segments = {}
+        for path in self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}"):
+            number = path.stem.rsplit(".", 1)[1]
+            if number.isdigit():
+                segments[int(number)] = path
+        return [segments[i] for i in sorted(segments, reverse=True)]
+
+    def _rotated(self) -> list[Path]:
+        """
+        If the file being followed has been rotated, the segments to finish reading
+        (starting with the one it was renamed to), oldest first.
+        """
+        if self.identity is None:
+            return []
+        try:
+            if self.path.stat().st_ino == self.identity[0]:
+                return []
+        except FileNotFoundError:
+            pass
+
+        segments = self.segments()
+        for i, path in enumerate(segments):
+            try:
+                if path.stat().st_ino == self.identity[0]:
+                    return segments[i:]
+            except FileNotFoundError:
+                pass
+        return []
+
+    def _read_lines(self, path: Path) -> bytes:
+        """The complete data lines added to `path` since the last read."""
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return b""
+
+        with f:
+            stat = os.fstat(f.fileno())
+            identity = (stat.st_ino, f.read(self.SIGNATURE_BYTES))
+            if self.identity is not None:
+                if identity[0] != self.identity[0]:
+                    # A different file (i.e., the next one after rotation)
+                    self.offset = 0
+                elif stat.st_size < self.offset or not identity[1].startswith(
+                    self.identity[1]
+                ):
+                    # Truncated (smaller than what we've read, or with different
+                    # first bytes). While the file is short, its first bytes can
+                    # still grow.
+                    self.offset = 0
+                    self.truncated = True
+            self.identity = identity
+
+            f.seek(self.offset)
+            chunk = f.read()
+
+        # Only take complete lines; a partially written one is picked up next time
+        chunk = chunk[: chunk.rfind(b"\n") + 1]
+        start = self.offset
+        self.offset += len(chunk)
+        if start == 0 and chunk:
+            # Every file starts with a header
+            header, _, chunk = chunk.partition(b"\n")
+            self.header = next(csv.reader([header.decode()]))
+        return chunk
+
+    def read(self) -> bytes:
+        self.truncated = False
+        paths = self._rotated() + [self.path]
+        return b"".join(self._read_lines(path) for path in paths)
+
+
+def merge_by_date(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    K-way merge of frames that are each sorted by date into one sorted frame.
+
+    A heap holds the date of the next unmerged row of each frame. Rather than
+    popping one row at a time, the whole run of rows up to the next frame's date is
+    taken at once (found by binary search), so the cost grows with the number of
+    runs, rather than rows. The frames must have matching (e.g., categorical) dtypes.
+    """
+    frames = [frame for frame in frames if len(frame)]
+    if len(frames) <= 1:
+        return frames[0] if frames else pd.DataFrame()
+
+    # (Plain lists of integers are much faster to search one at a time than arrays)
+    dates = [frame["date"].to_numpy().view("int64").tolist() for frame in frames]
+    # Position of each frame's first row once they're all concatenated
+    offsets = np.cumsum([0] + [len(frame) for frame in frames]).tolist()
+    heap = [(d[0], i, 0) for i, d in enumerate(dates)]
+    heapq.heapify(heap)
+    order = []
+    while heap:
+        _, i, start = heapq.heappop(heap)
+        end = len(dates[i])
+        if heap:
+            end = bisect.bisect_right(dates[i], heap[0][0], start)
+        order.extend(range(offsets[i] + start, offsets[i] + end))
+        if end < len(dates[i]):
+            heapq.heappush(heap, (dates[i][end], i, end))
+
+    merged = pd.concat(frames, ignore_index=True)
+    return merged.iloc[order].reset_index(drop=True)
+
+
+class LogTail:
+    """
+    Follows the CSV log files in `directory` matching `pattern` (e.g., one per
+    worker process), each with its own `FileTail`, and merges them (by date) into
+    an in-memory log. Each `read()` only parses the lines appended since the last
+    one, merges them with a k-way merge (see `merge_by_date()`), and appends them.
+    Files that show up later are picked up too. If any file is truncated, every
+    file is read again from the start.
+
+    The number of times each message has been logged (`message_counts`), a search
+    index over the messages and statuses (`index`), and the recent number of rows
+    (by status) per minute and per hour (`trends`), are kept up to date the same
+    way, from only the new rows.
+
+    Only the newest `max_rows` rows are kept (if given), so memory use stays the
+    same however long the app runs. The table's index holds each row's position
+    counting from the first row ever read (as in `index`), which doesn't change as
+    the oldest rows are dropped.
+
+    Dates are parsed once, as they're read, and columns with a small set of distinct
+    values (like the status and message) are stored as categoricals, i.e., as small
+    integer codes into a list of the distinct values, which takes a fraction of the
+    memory of a Python string per row.
+    """
+
+    DATE_COLUMNS = ["date"]
+    CATEGORICAL_COLUMNS = ["status", "message"]
+
+    def __init__(self, directory: Path, pattern: str, max_rows: int = None):
+        self.directory = directory
+        self.pattern = pattern
+        self.max_rows = max_rows
+        # Maps path -> FileTail
+        self.files = {}
+        self._reset()
+
+    def _reset(self):
+        self.tbl = pd.DataFrame()
+        # Position of the first row of `tbl`, counting from the first row ever read
+        self.first_row = 0
+        # Maps message -> number of rows with that message
+        self.message_counts = Counter()
+        self.index = LogIndex(self.CATEGORICAL_COLUMNS)
+        self.trends = {res: RollingCounts(*args) for res, args in TRENDS.items()}
+
+    def matches(self, path: Path) -> bool:
+        """Whether `path` is one of the log files (or a rotated segment of one)."""
+        if is_segment(path):
+            path = path.with_name(path.stem.rsplit(".", 1)[0] + path.suffix)
+        return path.match(self.pattern)
+
+    def _parse(self, lines: bytes, columns: list[str], path: Path) -> pd.DataFrame:
+        frame = pd.read_csv(
+            io.BytesIO(lines),
+            header=None,
+            names=columns,
+            dtype={col: "category" for col in self.CATEGORICAL_COLUMNS},
+            on_bad_lines="skip",
+        )
+        # Rows whose dates can't be parsed are dropped (rather than leaving the whole
+        # column as strings)
+        valid = pd.Series(True, index=frame.index)
+        for col in self.DATE_COLUMNS:
+            frame[col] = pd.to_datetime(frame[col], format="ISO8601", errors="coerce")
+            valid &= frame[col].notna()
+        if not valid.all():
+            logger.warning("Skipping %d malformed rows in %s", (~valid).sum(), path)
+            frame = frame[valid].reset_index(drop=True)
+        return frame
+
+    def _align_categories(self, tbl: pd.DataFrame, frames: list[pd.DataFrame]):
+        """
+        Categoricals only stay categorical when concatenated if their categories
+        match. New values are rare, so the existing rows rarely need recoding.
+
+        Returns recoded copies of `tbl` and `frames`, rather than changing them, since
+        `tbl` may already have been handed out to sessions.
+        """
+        for col in self.CATEGORICAL_COLUMNS:
+            categories = tbl[col].cat.categories if len(tbl) else None
+            for frame in frames:
+                if categories is None:
+                    categories = frame[col].cat.categories
+                elif not frame[col].cat.categories.isin(categories).all():
+                    categories = categories.union(frame[col].cat.categories)
+            if len(tbl) and len(categories) > len(tbl[col].cat.categories):
+                tbl = tbl.assign(**{col: tbl[col].cat.set_categories(categories)})
+            frames = [
+                frame.assign(**{col: frame[col].cat.set_categories(categories)})
+                for frame in frames
+            ]
+        return tbl, frames
+
+    def read(self) -> pd.DataFrame:
+        for path in sorted(self.directory.glob(self.pattern)):
+            if not is_segment(path) and path not in self.files:
+                self.files[path] = FileTail(path)
+
+        # The new lines are read (and parsed, and merged) with copies of the tails,
+        # so if that fails, nothing has changed and they're read again next time
+        tails = {path: copy.copy(file) for path, file in self.files.items()}
+        lines = {path: tail.read() for path, tail in tails.items()}
+        reset = any(tail.truncated for tail in tails.values())
+        if reset:
+            tails = {path: FileTail(path) for path in self.files}
+            lines = {path: tail.read() for path, tail in tails.items()}
+
+        frames = [
+            self._parse(chunk, tails[path].header, path)
+            for path, chunk in lines.items()
+            if chunk
+        ]
+        tbl = pd.DataFrame() if reset else self.tbl
+        if frames:
+            tbl, frames = self._align_categories(tbl, frames)
+            new = merge_by_date(frames)
+
+        if reset:
+            self._reset()
+        self.files = tails
+        if not frames:
+            return self.tbl
+
+        for trend in self.trends.values():
+            trend.add(new)
+
+        # Positions of the first new row, and of the first row to keep
+        end = self.first_row + len(tbl)
+        first = end + len(new) - self.max_rows if self.max_rows else 0
+        first = max(first, self.first_row)
+        if first > end:
+            # (Only when there are more new rows than are kept in all)
+            n_skip = first - end
+            new = new.iloc[n_skip:]
+        n_drop = min(first, end) - self.first_row
+        dropped, kept = tbl.iloc[:n_drop], tbl.iloc[n_drop:]
+
+        counts = self.message_counts.copy()
+        counts.update(self._message_counts(new))
+        counts.subtract(self._message_counts(dropped))
+        # (Leaving out messages that are no longer in any kept row)
+        self.message_counts = +counts
+        self.index.add(new, start=max(first, end))
+        self.index.drop_before(first)
+
+        tbl = new if kept.empty else pd.concat([kept, new], ignore_index=True)
+        self.tbl = tbl.set_axis(pd.RangeIndex(first, first + len(tbl)))
+        self.first_row = first
+        return self.tbl
+
+    @staticmethod
+    def _message_counts(tbl: pd.DataFrame) -> dict:
+        if tbl.empty:
+            return {}
+        counts = tbl["message"].value_counts()
+        return counts[counts > 0].to_dict()
+
+    def stat(self) -> list:
+        """A cheap summary of the log files, which changes whenever they do."""
+        result = []
+        for path in sorted(self.directory.glob(self.pattern)):
+            try:
+                stat = path.stat()
+                result.append((path, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                pass
+        return result
+
+
+# The log files to follow (relative to the app). Several files (e.g., one per worker
+# process, like `logs-2.csv`) are merged by date. Rotated segments are excluded.
+LOGS_GLOB = os.environ.get("LOGS_GLOB", "logs*.csv")
+
+# Number of (the newest) rows of the log kept in memory
+LOGS_KEEP_ROWS = int(os.environ.get("LOGS_KEEP_ROWS", 100_000))
+
+logs = LogTail(app_dir, LOGS_GLOB, LOGS_KEEP_ROWS)
+
+# Number of log rows shown per page
+PAGE_SIZE = 100
+
+
+def page_count(n_rows: int) -> int:
+    return max(math.ceil(n_rows / PAGE_SIZE), 1)
+
+
+def log_page(tbl: pd.DataFrame, page: int, rows: np.ndarray = None) -> pd.DataFrame:
+    """
+    The rows on `page` (starting from 0) of the log, newest first. Rows are only ever
+    appended, in time order, so this slices them off the end rather than sorting
+    the whole log. If `rows` (ascending row positions, e.g., search results) are
+    given, only those rows are paged through.
+    """
+    n_rows = len(tbl) if rows is None else len(rows)
+    end = max(n_rows - page * PAGE_SIZE, 0)
+    start = max(end - PAGE_SIZE, 0)
+    page_rows = slice(start, end) if rows is None else rows[start:end]
+    return tbl.iloc[page_rows].iloc[::-1]
+
+
+def search_logs(tbl: pd.DataFrame, query: str):
+    """
+    Positions of the rows of `tbl` that match `query` (see `LogIndex.search()`), or
+    `None` if there's nothing to search for.
+    """
+    if not LogIndex.words(query):
+        return None
+    rows = logs.index.search(query)
+    # The index may already include rows that were read after `tbl` (or have dropped
+    # some of its oldest rows). Both count positions from the first row ever read.
+    first = tbl.index[0] if len(tbl) else 0
+    rows = rows[(rows >= first) & (rows < first + len(tbl))]
+    return rows - first
+
+
+# How often to check the log for changes when file change notifications aren't
+# available (e.g., on some network file systems). When they are, the log is still
+# checked this many times less often, in case a notification is missed.
+POLL_SECS = 1
+POLL_SECS_WATCHED = 5
+
+# The log, shared by all sessions. It's only read when it changes, and only the new
+# lines are read.
+logs_df = reactive.value(logs.read())
+
+# Only one read of the (stateful) tail should be running at a time
+_refresh_lock = asyncio.Lock()
+
+
+async def refresh():
+    """Read any new lines in a worker thread, then update `logs_df`."""
+    async with _refresh_lock:
+        tbl = await asyncio.to_thread(logs.read)
+        with reactive.isolate():
+            if tbl is logs_df.get():
+                return
+
+        async with reactive.lock():
+            logs_df.set(tbl)
+            await reactive.flush()
+
+
+async def try_refresh():
+    """Like `refresh()`, but logs failures, so that the loops calling it keep going."""
+    try:
+        await refresh()
+    except Exception:
+        logger.warning("Reading the logs in %s failed", logs.directory, exc_info=True)
+
+
+def is_log_file(change, path: str) -> bool:
+    return logs.matches(Path(path))
+
+
+async def watch_logs():
+    """
+    Refresh whenever the OS reports a change to the logs (or their directory, so
+    that rotation and new files are noticed too). One watcher serves every session.
+    If watching fails, this logs why and returns, leaving it to `poll_logs()`.
+    """
+    try:
+        from watchfiles import awatch
+
+        async for _ in awatch(logs.directory, watch_filter=is_log_file):
+            await try_refresh()
+    except Exception:
+        logger.warning(
+            "Watching %s failed, falling back to polling",
+            logs.directory,
+            exc_info=True,
+        )
+
+
+async def poll_logs(watcher: asyncio.Task):
+    last = None
+    while True:
+        await asyncio.sleep(POLL_SECS if watcher.done() else POLL_SECS_WATCHED)
+        try:
+            current = await asyncio.to_thread(logs.stat)
+        except Exception:
+            logger.warning("Checking %s failed", logs.directory, exc_info=True)
+            continue
+        if current != last:
+            last = current
+            await try_refresh()
+
+
 # NOTE: the session_context(None) here is only necessary at the moment
 # for Express -- this should improve/change in a future release
 # https://github.com/posit-dev/py-shiny/issues/1079
 with session_context(None):
 
-    @reactive.file_reader(app_dir / "logs.csv")
-    def logs_df():
-        return pd.read_csv(app_dir / "logs.csv")
+    @reactive.effect
+    def _():
+        # Runs once, on the app's event loop. If the watcher can't be started (or
+        # stops), polling takes over.
+        watcher = asyncio.create_task(watch_logs())
+        asyncio.create_task(poll_logs(watcher))
+        # Catch up on anything written since the module was imported
+        asyncio.create_task(try_refresh())
+
+    # Shared by all sessions, and only as expensive as the number of distinct
+    # messages, since the counts themselves are kept up to date by `logs`
+    @reactive.calc
+    def message_counts_df():
+        logs_df()
+        return pd.DataFrame(
+            logs.message_counts.most_common(), columns=["message", "count"]
+        )
+
+    # Likewise for the trends: maps resolution -> (rates, statuses)
+    @reactive.calc
+    def trends_dfs():
+        logs_df()
+        # The windows end at the current time, so move them along (at the start of
+        # each of the smallest buckets) even when nothing is being logged
+        secs = min(bucket_secs for bucket_secs, _ in TRENDS.values())
+        reactive.invalidate_later(secs - time.time() % secs)
+        return {
+            res: (trend.rates(), trend.statuses()) for res, trend in logs.trends.items()
+        }
+
+
+def plot_rates(d: pd.DataFrame):
+    fig = px.bar(d, x="time", y="count", labels={"time": "", "count": "Messages"})
+    fig.update_layout(margin=dict(l=0, r=0, t=0, b=0), bargap=0.1)
+    return fig
+
+
+def plot_statuses(d: pd.DataFrame):
+    fig = px.bar(
+        d,
+        x="share",
+        y="status",
+        orientation="h",
+        labels={"share": "Share of messages", "status": ""},
+    )
+    fig.update_xaxes(tickformat=".0%")
+    fig.update_yaxes(autorange="reversed")
+    fig.update_layout(margin=dict(l=0, r=0, t=0, b=0))
+    return fig
+
+
+def update_bars(widget, x, y):
+    """Point the (only) trace of a bar chart at new data (see `update_timeseries()`)."""
+    with widget.batch_animate():
+        widget.data[0].update(x=x, y=y)
@@ -1,9 +1,17 @@
-import io
+import asyncio
 import random
 
 import faicons
 import pandas as pd
-from shared import files_df, process, watch_folder
+from shared import (
+    FilePreview,
+    file_chunks,
+    file_table,
+    files_df,
+    files_stats,
+    index,
+    watch_folder,
+)
 from shiny import App, Inputs, Outputs, Session, reactive, render, req, ui
 
 app_ui = ui.page_fillable(
@@ -28,12 +36,20 @@ app_ui = ui.page_fillable(
 
 
 def server(input: Inputs, output: Outputs, session: Session):
-    # When the session ends, end the folder watching process
-    session.on_ended(process.kill)
-
+    # Only re-rendered when the list of files changes. Statistics that come in after
+    # that are patched in, which keeps the user's selection (and sorting).
     @render.data_frame
     def file_list():
-        return render.DataGrid(files_df(), selection_mode="row")
+        with reactive.isolate():
+            stats = files_stats()
+        return render.DataGrid(file_table(files_df(), stats), selection_mode="row")
+
+    @reactive.effect
+    @reactive.event(files_stats, ignore_init=True)
+    async def _():
+        with reactive.isolate():
+            files = files_df()
+        await file_list.update_data(file_table(files, files_stats()))
 
     @render.ui
     def log_output():
@@ -47,23 +63,96 @@ def server(input: Inputs, output: Outputs, session: Session):
         return ui.card(
             ui.card_header(
                 "Log output",
-                ui.download_link(
-                    "download", "Download", icon=faicons.icon_svg("download")
+                ui.div(
+                    ui.download_link(
+                        "download", "Download", icon=faicons.icon_svg("download")
+                    ),
+                    ui.download_link(
+                        "download_gz", "Gzipped", icon=faicons.icon_svg("file-zipper")
+                    ),
+                    class_="d-flex gap-3",
                 ),
                 class_="d-flex justify-content-between align-items-center",
             ),
             ui.output_data_frame("data_grid"),
+            ui.card_footer(
+                ui.output_text("preview_info"),
+                ui.input_action_button(
+                    "more",
+                    "Load more",
+                    icon=faicons.icon_svg("angles-down"),
+                    class_="btn-sm",
+                ),
+                class_="d-flex justify-content-between align-items-center",
+            ),
         )
 
+    # The name and (modification time, size) of the selected file. This only changes
+    # when another file is selected, or the selected file itself changes, so that
+    # other files coming and going don't make the preview start over.
+    selected_file = reactive.value(None)
+
+    @reactive.effect
+    def _():
+        idx = input.file_list_selected_rows()
+        files = files_df()
+        if not idx or idx[0] >= len(files):
+            selected_file.set(None)
+            return
+        name = files["File Name"][idx[0]]
+        selected_file.set((name, index.info(name)))
+
     @reactive.calc
-    def selected_file():
-        idx = req(input.file_list_selected_rows())
-        file = files_df()["File Name"][idx[0]]
-        return pd.read_csv(watch_folder / file)
+    def selected_path():
+        name, _ = req(selected_file())
+        return watch_folder / name
+
+    # The selected file is previewed a page at a time, starting with the first page
+    # and loading another one each time "Load more" is clicked
+    @reactive.calc
+    def preview():
+        return FilePreview(selected_path())
+
+    n_pages = reactive.value(1)
+
+    @reactive.effect
+    @reactive.event(input.file_list_selected_rows)
+    def _():
+        n_pages.set(1)
+
+    @reactive.effect
+    @reactive.event(input.more)
+    def _():
+        n_pages.set(n_pages() + 1)
+
+    # Pages that haven't been read yet are read in a worker thread, so a big page
+    # doesn't hold up other sessions
+    @reactive.calc
+    async def preview_rows():
+        return await asyncio.to_thread(preview().read, n_pages())
+
+    @reactive.calc
+    async def all_loaded():
+        # (Once the pages have been read, this only needs to look for one more)
+        await preview_rows()
+        return await asyncio.to_thread(preview().is_last, n_pages() - 1)
+
+    @reactive.effect
+    async def _():
+        ui.update_action_button("more", disabled=await all_loaded())
 
     @render.data_frame
-    def data_grid():
-        return render.DataGrid(selected_file())
+    async def data_grid():
+        return render.DataGrid(await preview_rows())
+
+    @render.text
+    async def preview_info():
+        n = len(await preview_rows())
+        return (
+            f"Showing all {n} rows"
+            if await all_loaded()
+            else f"Showing the first {n} rows"
+        )
 
     @reactive.effect
     @reactive.event(input.add)
@@ -73,12 +162,16 @@ def server(input: Inputs, output: Outputs, session: Session):
         id = random.randint(100, 999)
         sampled_logs.to_csv(watch_folder / f"logs-{id}.csv")
 
-    @render.download(filename="logs.csv")
+    # Downloads are streamed from the file itself, rather than the parsed rows
+    @render.download(filename=lambda: selected_path().name)
     def download():
-        csv = selected_file()
-        with io.StringIO() as buf:
-            csv.to_csv(buf)
-            yield buf.getvalue().encode()
+        yield from file_chunks(selected_path())
+
+    @render.download(
+        filename=lambda: f"{selected_path().name}.gz", media_type="application/gzip"
+    )
+    def download_gz():
+        yield from file_chunks(selected_path(), compress=True)
 
 
 app = App(app_ui, server)
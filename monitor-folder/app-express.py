@@ -1,11 +1,19 @@
-import io
+import asyncio
 import random
 
 import faicons
 import pandas as pd
-from shared import files_df, process, watch_folder
+from shared import (
+    FilePreview,
+    file_chunks,
+    file_table,
+    files_df,
+    files_stats,
+    index,
+    watch_folder,
+)
 from shiny import reactive, req
-from shiny.express import input, render, session, ui
+from shiny.express import input, render, ui
 
 ui.page_opts(fillable=True)
 
@@ -17,9 +25,13 @@ with ui.layout_columns(col_widths=[4, 8]):
                 faicons.icon_svg("plus")
                 ui.input_action_button("add", "Add new logs")
 
+        # Only re-rendered when the list of files changes. Statistics that come in
+        # after that are patched in, which keeps the user's selection (and sorting).
         @render.data_frame
         def file_list():
-            return render.DataGrid(files_df(), selection_mode="row")
+            with reactive.isolate():
+                stats = files_stats()
+            return render.DataGrid(file_table(files_df(), stats), selection_mode="row")
 
     @render.express
     def log_output():
@@ -36,23 +48,117 @@ with ui.layout_columns(col_widths=[4, 8]):
                 ):
                     "Log output"
 
-                    @render.download(filename="logs.csv")
-                    def download():
-                        csv = selected_file()
-                        with io.StringIO() as buf:
-                            csv.to_csv(buf)
-                            yield buf.getvalue().encode()
+                    # Downloads are streamed from the file itself, rather than the
+                    # parsed rows
+                    with ui.div(class_="d-flex gap-3"):
+
+                        @render.download(
+                            label="Download", filename=lambda: selected_path().name
+                        )
+                        def download():
+                            yield from file_chunks(selected_path())
+
+                        @render.download(
+                            label="Gzipped",
+                            filename=lambda: f"{selected_path().name}.gz",
+                            media_type="application/gzip",
+                        )
+                        def download_gz():
+                            yield from file_chunks(selected_path(), compress=True)
 
                 @render.data_frame
-                def data_grid():
-                    return render.DataGrid(selected_file())
+                async def data_grid():
+                    return render.DataGrid(await preview_rows())
+
+                with ui.card_footer(
+                    class_="d-flex justify-content-between align-items-center"
+                ):
+
+                    @render.text
+                    async def preview_info():
+                        n = len(await preview_rows())
+                        if await all_loaded():
+                            return f"Showing all {n} rows"
+                        return f"Showing the first {n} rows"
+
+                    ui.input_action_button(
+                        "more",
+                        "Load more",
+                        icon=faicons.icon_svg("angles-down"),
+                        class_="btn-sm",
+                    )
+
+
+@reactive.effect
+@reactive.event(files_stats, ignore_init=True)
+async def _():
+    with reactive.isolate():
+        files = files_df()
+    await file_list.update_data(file_table(files, files_stats()))
+
+
+# The name and (modification time, size) of the selected file. This only changes when
+# another file is selected, or the selected file itself changes, so that other files
+# coming and going don't make the preview start over.
+selected_file = reactive.value(None)
+
+
+@reactive.effect
+def _():
+    idx = input.file_list_selected_rows()
+    files = files_df()
+    if not idx or idx[0] >= len(files):
+        selected_file.set(None)
+        return
+    name = files["File Name"][idx[0]]
+    selected_file.set((name, index.info(name)))
 
 
 @reactive.calc
-def selected_file():
-    idx = req(input.file_list_selected_rows())
-    file = files_df()["File Name"][idx[0]]
-    return pd.read_csv(watch_folder / file)
+def selected_path():
+    name, _ = req(selected_file())
+    return watch_folder / name
+
+
+# The selected file is previewed a page at a time, starting with the first page and
+# loading another one each time "Load more" is clicked
+@reactive.calc
+def preview():
+    return FilePreview(selected_path())
+
+
+n_pages = reactive.value(1)
+
+
+@reactive.effect
+@reactive.event(input.file_list_selected_rows)
+def _():
+    n_pages.set(1)
+
+
+@reactive.effect
+@reactive.event(input.more)
+def _():
+    n_pages.set(n_pages() + 1)
+
+
+# Pages that haven't been read yet are read in a worker thread, so a big page
+# doesn't hold up other sessions
+@reactive.calc
+async def preview_rows():
+    return await asyncio.to_thread(preview().read, n_pages())
+
+
+@reactive.calc
+async def all_loaded():
+    # (Once the pages have been read, this only needs to look for one more)
+    await preview_rows()
+    return await asyncio.to_thread(preview().is_last, n_pages() - 1)
+
+
+@reactive.effect
+async def _():
+    ui.update_action_button("more", disabled=await all_loaded())
 
 
 @reactive.effect
@@ -62,7 +168,3 @@ def sim_logs():
     sampled_logs = logs.sample(n=1000, replace=True)
     id = random.randint(100, 999)
     sampled_logs.to_csv(watch_folder / f"logs-{id}.csv")
-
-
-# When the session ends, end the folder watching process
-_ = session.on_ended(process.kill)
@@ -1,4 +1,11 @@
-import subprocess
+import asyncio
+import io
+import json
+import os
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -10,29 +17,510 @@ app_dir = Path(__file__).parent
 
 # The directory to watch for changes
 watch_folder = app_dir / "watch_folder"
-# The file to update when a change is detected (DO NOT PUT THIS INSIDE `watch_folder`!)
-last_change = app_dir / "last_change.txt"
+# Where the index of `watch_folder` is saved between runs of the app (DO NOT PUT THIS
+# INSIDE `watch_folder`!)
+index_snapshot = app_dir / "folder_index.json"
+# Number of rows read at a time when previewing a file, and the number of bytes read
+# at a time when looking for the rows
+PAGE_ROWS = 1000
+SCAN_BYTES = 1024 * 1024
+# Size of the chunks that files are downloaded in
+CHUNK_SIZE = 1024 * 1024
+# Number of threads that profile new (or changed) files in the background, and the
+# number of rows they read at a time
+PROFILE_WORKERS = int(os.environ.get("FOLDER_PROFILE_WORKERS", 2))
+PROFILE_CHUNK_ROWS = 100_000
+STATS_COLUMNS = ["Rows", "From", "To", "Top Statuses"]
+# How often (in seconds) finished profiles are shown
+PROFILE_UPDATE_SECS = 1
+# How often (in seconds) changes to the index are saved to its snapshot, at most
+SAVE_SECS = 10
+# Memory budget for parsed pages of files, shared by all sessions
+CACHE_BYTES = int(os.environ.get("FOLDER_CACHE_MB", 256)) * 1024 * 1024
 
-# Start a background process to watch the `watch_folder` directory
-# and update the `last_change` file when a change is detected
-process = subprocess.Popen(
-    ["python", app_dir / "watch_folder.py", str(watch_folder), str(last_change)]
-)
+
+class FolderIndex:
+    """
+    The name, modification time and size of every file in a folder, kept up to date
+    by applying the changes (added, modified and deleted paths) reported by the
+    watcher, so that a change to one file only costs a `stat()` of that file. Along
+    with each file, the index keeps its summary statistics (see `profile_file()`),
+    which are dropped whenever the file changes.
+
+    The index is saved to `snapshot` (see `save_index()`), and loaded from it on
+    startup, so the file list is available right away. Since files can change while
+    the app isn't running (and editing a file doesn't change the folder's own
+    modification time), the folder is then scanned once in the background, and any
+    differences are applied (see `check()`).
+    """
+
+    def __init__(self, folder: Path, snapshot: Path):
+        self.folder = folder.resolve()
+        self.snapshot = snapshot
+        # The watcher and the profiler update the index from worker threads
+        self.lock = threading.Lock()
+        # Whether the index has changed since it was last saved
+        self.dirty = False
+        self.files, self.stats = self._load()
+        if self.files is None:
+            self.files = self.scan()
+            self.dirty = True
+        # Formatted "Last Edited" times, so they're only formatted once per change
+        self.labels = {name: self._label(info) for name, info in self.files.items()}
+
+    def _load(self):
+        try:
+            data = json.loads(self.snapshot.read_text())
+        except (FileNotFoundError, ValueError):
+            return None, {}
+        files = {name: tuple(info) for name, info in data["files"].items()}
+        # Maps name -> (file info, stats)
+        stats = {
+            name: (tuple(info), summary)
+            for name, (info, summary) in data.get("stats", {}).items()
+            if files.get(name) == tuple(info)
+        }
+        return files, stats
+
+    def scan(self) -> dict:
+        with os.scandir(self.folder) as entries:
+            return {entry.name: self._info(entry.stat()) for entry in entries}
+
+    @staticmethod
+    def _info(stat):
+        return (stat.st_mtime, stat.st_size)
+
+    @staticmethod
+    def _label(info):
+        return datetime.fromtimestamp(info[0]).strftime("%Y-%m-%d %H:%M:%S")
+
+    def _set(self, name: str, info):
+        # (With the lock held.) Returns whether anything changed.
+        if info is None:
+            self.labels.pop(name, None)
+            self.stats.pop(name, None)
+            return self.files.pop(name, None) is not None
+        if self.files.get(name) == info:
+            return False
+        self.files[name] = info
+        self.labels[name] = self._label(info)
+        self.stats.pop(name, None)
+        return True
+
+    def apply(self, changes):
+        """
+        Apply a set of (change, path) pairs, where `change` is "added", "modified"
+        or "deleted". Returns whether the index changed.
+        """
+        changed = False
+        with self.lock:
+            for change, path in changes:
+                path = Path(path)
+                # Only direct children of the folder are listed
+                if path.parent.resolve() != self.folder:
+                    continue
+                info = None
+                if change != "deleted":
+                    try:
+                        info = self._info(path.stat())
+                    except FileNotFoundError:
+                        pass
+                changed |= self._set(path.name, info)
+            self.dirty |= changed
+        return changed
+
+    def check(self):
+        """
+        Scan the folder, and bring the index up to date with any files that were
+        added, changed or removed without the watcher seeing it. Returns whether the
+        index changed.
+        """
+        files = self.scan()
+        changed = False
+        with self.lock:
+            for name in self.files.keys() - files.keys():
+                changed |= self._set(name, None)
+            for name, info in files.items():
+                changed |= self._set(name, info)
+            self.dirty |= changed
+        return changed
+
+    def unprofiled(self) -> list:
+        """(name, file info) of the files that have no (up to date) statistics."""
+        with self.lock:
+            return [
+                (name, info)
+                for name, info in self.files.items()
+                if self.stats.get(name, (None,))[0] != info
+            ]
+
+    def set_stats(self, name: str, info: tuple, summary: dict):
+        with self.lock:
+            # (The file may have changed since it was profiled)
+            if self.files.get(name) == info:
+                self.stats[name] = (info, summary)
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({"files": self.files, "stats": self.stats})
+            self.dirty = False
+        # Write to a temporary file first, so a crash never leaves a partial snapshot
+        tmp = self.snapshot.with_suffix(".tmp")
+        tmp.write_text(data)
+        os.replace(tmp, self.snapshot)
+
+    def info(self, name: str):
+        """The (modification time, size) of a file, or None if it isn't indexed."""
+        with self.lock:
+            return self.files.get(name)
+
+    def to_frame(self) -> pd.DataFrame:
+        with self.lock:
+            names = sorted(self.files)
+            labels = [self.labels[n] for n in names]
+        return pd.DataFrame({"File Name": names, "Last Edited": labels})
+
+    def stats_frame(self) -> pd.DataFrame:
+        """Statistics of the files that have been profiled."""
+        with self.lock:
+            stats = [(name, summary) for name, (_, summary) in self.stats.items()]
+        return pd.DataFrame(
+            [
+                (
+                    name,
+                    s.get("rows"),
+                    s.get("from"),
+                    s.get("to"),
+                    top_statuses(s.get("statuses")),
+                )
+                for name, s in stats
+            ],
+            columns=["File Name", *STATS_COLUMNS],
+            dtype=object,
+        )
+
+
+def file_table(files: pd.DataFrame, stats: pd.DataFrame) -> pd.DataFrame:
+    """The list of files, with their statistics (blank until they're profiled)."""
+    table = files.merge(stats, on="File Name", how="left")
+    table[STATS_COLUMNS] = table[STATS_COLUMNS].astype(object)
+    return table.where(table.notna(), None)
+
+
+def profile_file(path: Path) -> dict:
+    """
+    The number of rows, the time range (of the `date` column) and the histogram of
+    the `status` column of a log file. The file is read in chunks, and only those
+    two columns, so memory use doesn't depend on the size of the file.
+    """
+    rows = 0
+    first = last = None
+    statuses = Counter()
+    chunks = pd.read_csv(
+        path,
+        usecols=lambda col: col in ("date", "status"),
+        chunksize=PROFILE_CHUNK_ROWS,
+    )
+    for chunk in chunks:
+        rows += len(chunk)
+        if "date" in chunk:
+            dates = pd.to_datetime(chunk["date"], errors="coerce").dropna()
+            if len(dates):
+                first = dates.min() if first is None else min(first, dates.min())
+                last = dates.max() if last is None else max(last, dates.max())
+        if "status" in chunk:
+            statuses.update(chunk["status"].value_counts().to_dict())
+
+    def fmt(date):
+        return None if date is None else date.strftime("%Y-%m-%d %H:%M:%S")
+
+    return {
+        "rows": rows,
+        "from": fmt(first),
+        "to": fmt(last),
+        "statuses": dict(statuses.most_common()),
+    }
+
+
+def top_statuses(statuses, n=3):
+    if not statuses:
+        return None
+    top = [f"{status} ({count})" for status, count in list(statuses.items())[:n]]
+    return ", ".join(top) + (", ..." if len(statuses) > n else "")
+
+
+class PageCache:
+    """
+    Parsed pages of files, shared by all sessions, so a page that several users look
+    at is only parsed once. Pages are keyed by the file's path, modification time and
+    size (and the page number), so a file that has changed is parsed again rather
+    than served stale. Once the pages take up more than `max_bytes`, the least
+    recently used ones are dropped.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        # Maps key -> (page, bytes), least recently used first
+        self.entries = OrderedDict()
+
+    def get(self, key, parse) -> pd.DataFrame:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+
+        # (Parsed without the lock held, so other sessions aren't kept waiting)
+        page = parse()
+        nbytes = int(page.memory_usage(deep=True).sum())
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key][0]
+            self.entries[key] = (page, nbytes)
+            self.nbytes += nbytes
+            # (Always keeping the page just parsed, even if it's over budget by itself)
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, nbytes) = self.entries.popitem(last=False)
+                self.nbytes -= nbytes
+        return page
+
+
+page_cache = PageCache()
+
+
+class FilePreview:
+    """
+    Reads a (CSV) file a page of rows at a time, so that opening even a very large
+    file is instant, and only the pages that are shown are ever read into memory.
+
+    The offset of each page's first line is recorded as the file is scanned, which
+    only happens as far as the pages that have been asked for. If the file changes
+    (or is replaced), it's opened again and scanned from the start. (The file is read
+    with plain reads rather than memory mapped, since accessing a mapping of a file
+    that has since been truncated would crash the whole process.)
+    """
+
+    def __init__(self, path: Path, page_rows: int = PAGE_ROWS, cache=page_cache):
+        self.path = path
+        self.page_rows = page_rows
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.file = None
+        self._open()
+
+    def _open(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.path, "rb")
+        stat = os.fstat(self.file.fileno())
+        self.size = stat.st_size
+        self.version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        # Identifies this version of the file in the cache
+        self.key = (
+            str(self.path.resolve()),
+            stat.st_mtime_ns,
+            stat.st_size,
+            self.page_rows,
+        )
+        # The first page starts after the header
+        self.page_starts = [self._skip_lines(0, 1)]
+        self.header = self._read(0, self.page_starts[0])
+        # Known once the end of the file has been reached
+        self.n_pages = None
+
+    def _check(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # Keep reading the (still open) file that was there
+            return
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) != self.version:
+            self._open()
+
+    def _read(self, pos: int, n: int) -> bytes:
+        self.file.seek(pos)
+        return self.file.read(n)
+
+    def _skip_lines(self, pos: int, n: int) -> int:
+        while n and pos < self.size:
+            block = self._read(pos, SCAN_BYTES)
+            if not block:
+                # (The file shrank, which the next check will notice)
+                return self.size
+            count = block.count(b"\n")
+            if count < n:
+                n -= count
+                pos += len(block)
+                continue
+            end = -1
+            for _ in range(n):
+                end = block.find(b"\n", end + 1)
+            return pos + end + 1
+        return min(pos, self.size)
+
+    def _find_page(self, page: int):
+        while len(self.page_starts) <= page and self.n_pages is None:
+            end = self._skip_lines(self.page_starts[-1], self.page_rows)
+            if end >= self.size:
+                self.n_pages = len(self.page_starts)
+            else:
+                self.page_starts.append(end)
+
+    def _offset(self, page: int) -> int:
+        self._find_page(page)
+        return self.page_starts[page] if page < len(self.page_starts) else self.size
+
+    def is_last(self, page: int) -> bool:
+        with self.lock:
+            self._check()
+            self._find_page(page + 1)
+            return self.n_pages is not None and page + 1 >= self.n_pages
+
+    def _parse(self, page: int) -> pd.DataFrame:
+        if not self.header:
+            return pd.DataFrame()
+        begin, end = self._offset(page), self._offset(page + 1)
+        return pd.read_csv(io.BytesIO(self.header + self._read(begin, end - begin)))
+
+    def read(self, n_pages: int) -> pd.DataFrame:
+        """
+        The rows of the first `n_pages` pages (which can take a while for pages that
+        haven't been read yet, so call this from a worker thread).
+        """
+        with self.lock:
+            self._check()
+            self._find_page(n_pages)
+            if self.n_pages is not None:
+                n_pages = min(n_pages, self.n_pages)
+            # Each page is read (and parsed) once, and kept in the cache
+            pages = [
+                self.cache.get((*self.key, page), lambda page=page: self._parse(page))
+                for page in range(max(n_pages, 1))
+            ]
+        return pd.concat(pages, ignore_index=True)
+
+
+def file_chunks(path: Path, compress: bool = False):
+    """
+    Yield the contents of `path` straight from disk, a chunk at a time (gzipped on
+    the fly if `compress`), so that a download only ever holds one chunk in memory.
+    """
+    # (wbits=31 writes a gzip, rather than zlib, header and trailer)
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    if compressor:
+        yield compressor.flush()
+
+
+index = FolderIndex(watch_folder, index_snapshot)
+
+# Filenames and last edited times of the files within the `watch_folder`
+files_df = reactive.value(index.to_frame())
+# Statistics of the files (see `file_table()`). They're kept apart from `files_df`, so
+# that they can be filled in without everything that depends on the list of files
+# having to update.
+files_stats = reactive.value(index.stats_frame())
+
+profile_pool = ThreadPoolExecutor(PROFILE_WORKERS, thread_name_prefix="profile")
+# Set when there may be new files to profile
+profile_wanted = asyncio.Event()
+
+
+async def update_files(stats_only: bool = False):
+    # Outside of any session, so flush ourselves
+    async with reactive.lock():
+        if not stats_only:
+            files_df.set(index.to_frame())
+        files_stats.set(index.stats_frame())
+        await reactive.flush()
+
+
+async def check_index():
+    # Catch up on anything that changed while the app wasn't running
+    if await asyncio.to_thread(index.check):
+        profile_wanted.set()
+        await update_files()
+
+
+async def save_index():
+    """
+    Save the index (in a worker thread), if it has changed, every `SAVE_SECS`. This
+    way, saving the whole index is never part of handling a single change.
+    """
+    while True:
+        await asyncio.sleep(SAVE_SECS)
+        if index.dirty:
+            await asyncio.to_thread(index.save)
+
+
+async def watch_files():
+    """
+    Apply each set of changes that the OS reports in `watch_folder` to the index (in
+    a worker thread), then update `files_df`. One watcher serves every session.
+    """
+    from watchfiles import awatch
+
+    async for changes in awatch(watch_folder):
+        changes = [(change.name, path) for change, path in changes]
+        if not await asyncio.to_thread(index.apply, changes):
+            continue
+        profile_wanted.set()
+        await update_files()
+
+
+async def profile_files():
+    """
+    Profile every file that has no (up to date) statistics on `profile_pool`, once
+    per version of the file. Finished profiles are recorded in the index, then shown
+    together (at most every `PROFILE_UPDATE_SECS`), rather than one by one.
+    """
+    loop = asyncio.get_running_loop()
+    # Maps future -> (name, file info)
+    running = {}
+    while True:
+        profile_wanted.clear()
+        queued = set(running.values())
+        for name, info in index.unprofiled():
+            if (name, info) not in queued:
+                future = loop.run_in_executor(
+                    profile_pool, profile_file, watch_folder / name
+                )
+                running[future] = (name, info)
+
+        if not running:
+            await profile_wanted.wait()
+            continue
+
+        done, _ = await asyncio.wait(running, timeout=PROFILE_UPDATE_SECS)
+        for future in done:
+            name, info = running.pop(future)
+            try:
+                summary = future.result()
+            except Exception:
+                # Not a (readable) log file, or it's gone. Record that, so it isn't
+                # read again until it changes.
+                summary = {}
+            index.set_stats(name, info, summary)
+        if done:
+            await update_files(stats_only=True)
 
 
-# Get filenames and last edited times within the `watch_folder`
-# (when a change is detected)
-#
 # NOTE: the session_context(None) here is only necessary at the moment
 # for Express -- this should improve/change in a future release
 # https://github.com/posit-dev/py-shiny/issues/1079
 with session_context(None):
 
-    @reactive.file_reader(last_change)
-    def files_df():
-        files_info = []
-        for file in watch_folder.glob("*"):
-            mtime = datetime.fromtimestamp(file.stat().st_mtime)
-            info = (file.name, mtime.strftime("%Y-%m-%d %H:%M:%S"))
-            files_info.append(info)
-        return pd.DataFrame(files_info, columns=["File Name", "Last Edited"])
+    @reactive.effect
+    def _():
+        # Runs once, on the app's event loop
+        asyncio.create_task(watch_files())
+        asyncio.create_task(check_index())
+        asyncio.create_task(save_index())
+        asyncio.create_task(profile_files())